@@ -1,17 +1,46 @@
 """
 METAR DIGITAL - VERSIÓN FLASK
-Aeropuerto Internacional Jorge Chávez (SPJC) - CORPAC Perú
+Aeropuerto Internacional Jorge Chávez (SPJC) y demás estaciones de
+estaciones.json - CORPAC Perú
 """
 
-from flask import Flask, render_template, request, session, redirect, url_for, send_file, jsonify
+from flask import Flask, render_template, request, session, redirect, url_for, send_file, jsonify, Response, g
+from flask.sessions import SecureCookieSessionInterface
 from datetime import datetime, timezone
 from pathlib import Path
-from io import BytesIO
-from decimal import Decimal, ROUND_HALF_UP
-import pandas as pd
+import numpy as np
 import re
+import csv
+import secrets
 import hmac
+import io
+import json
+import importlib
 import os
+import time
+import sqlite3
+import threading
+import atexit
+import calendar
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right, insort
+from datetime import timedelta
+
+import archivo_columnar
+import control_calidad
+from bloqueo import bloqueo_archivo
+from difusion import Difusor
+from estaciones import estaciones, reglas
+from estadisticas import CacheEstadisticas
+from exportaciones import RE_ID, ColaExportaciones, PoolExportaciones
+from metricas import Contador, Histograma, Indicador, etapa, exponer
+from registro import COLUMNAS_EXCEL, RegistroMetar
+from codificador import (
+    ESTACION, convertir_visibilidad, generar_metar, interpretar_nubes_lista,
+    procesar_rvr, procesar_viento, procesar_visibilidad_minima, redondear_metar,
+    validar_info_suplementaria, validar_temp_qnh,
+)
+# pandas y openpyxl se importan recién al leer o escribir un Excel (ver precalentar())
 
 # ─────────────────────────────────────────────
 # CONFIGURACIÓN
@@ -19,8 +48,8 @@ import os
 app = Flask(__name__)
 app.secret_key = "corpac_spjc_2024_secreto"   # Cambia esto en producción
 
-DIRECTORIO_DATOS = Path("datos_metar")
-DIRECTORIO_DATOS.mkdir(exist_ok=True)
+DIRECTORIO_DATOS = Path("datos_metar")      # una carpeta por estación, creada al abrir su almacén
+ARCHIVO_COLUMNAR = DIRECTORIO_DATOS / "archivo"
 
 # Usuarios y contraseñas (puedes editar aquí)
 USUARIOS = {
@@ -60,347 +89,1100 @@ OCTAS_LABELS = {
 }
 
 
+# Segundos que el escritor espera para agrupar cambios antes de regenerar el Excel
+DEMORA_ESCRITURA = 2.0
+
+# Reportes de varios meses: tamaño máximo del rango y trabajos simultáneos
+# (por worker, sumando todas las estaciones)
+MAX_MESES_REPORTE = 36
+MAX_EXPORTACIONES = 2
+
+# Boletines del historial compartido (página principal y /api/historial)
+HISTORIAL_MAXIMO = 20
+
+# Peticiones que tardan más que esto (segundos) se registran con su desglose por etapa
+UMBRAL_LENTO = float(os.environ.get("METAR_UMBRAL_LENTO", "0.5"))
+
+
+# ─────────────────────────────────────────────
+# MÉTRICAS
+# ─────────────────────────────────────────────
+duracion_peticion = Histograma("metar_peticion_segundos", "Duración de las peticiones por ruta")
+peticiones_lentas = Contador("metar_peticiones_lentas_total",
+                             f"Peticiones de más de {UMBRAL_LENTO} s")
+bytes_sesion      = Indicador("metar_sesion_bytes", "Tamaño de la cookie de sesión en la última respuesta")
+bytes_excel       = Indicador("metar_excel_bytes", "Tamaño del Excel mensual tras la última escritura")
+
+
+class SesionMedida(SecureCookieSessionInterface):
+    """Sesión en cookie que mide cuánto tarda en serializarse y cuánto pesa."""
+
+    def save_session(self, app, sesion, respuesta):
+        with etapa("sesion_guardar"):
+            super().save_session(app, sesion, respuesta)
+        for cabecera in respuesta.headers.getlist("Set-Cookie"):
+            if cabecera.startswith(f"{self.get_cookie_name(app)}="):
+                bytes_sesion.fijar(len(cabecera))
+
+app.session_interface = SesionMedida()
+
+@app.before_request
+def _iniciar_medicion():
+    g.inicio = time.perf_counter()
+
+@app.after_request
+def _anotar_estado(respuesta):
+    g.estado = respuesta.status_code
+    return respuesta
+
+@app.teardown_request
+def _cerrar_medicion(_error=None):
+    if "inicio" not in g:
+        return
+    total = time.perf_counter() - g.inicio
+    ruta  = request.url_rule.rule if request.url_rule else "(sin ruta)"
+    duracion_peticion.observar(total, ruta=ruta, metodo=request.method,
+                               estado=g.get("estado", 500))
+    if total > UMBRAL_LENTO:
+        peticiones_lentas.incrementar(ruta=ruta)
+        desglose = ", ".join(f"{n}={d * 1000:.1f}ms" for n, d in g.get("etapas", []))
+        app.logger.warning("Petición lenta: %s %s %.0f ms (%s)",
+                           request.method, ruta, total * 1000, desglose or "sin etapas")
+
+def renderizar(plantilla, **contexto):
+    with etapa("plantilla"):
+        return render_template(plantilla, **contexto)
+
+
 # ─────────────────────────────────────────────
 # HELPERS DE SESIÓN
 # ─────────────────────────────────────────────
 def sesion_init():
-    """Inicializa los datos de sesión si no existen."""
-    if "registros" not in session:
-        session["registros"] = cargar_registros_mes()
-    if "historial" not in session:
-        session["historial"] = []
-    if "fenomenos_lista" not in session:
-        session["fenomenos_lista"] = []
-    if "nubes_lista" not in session:
-        session["nubes_lista"] = []
-    if "ultimo_metar" not in session:
-        session["ultimo_metar"] = None
-    if "ultimo_tipo" not in session:
-        session["ultimo_tipo"] = None
+    """Inicializa los datos de sesión si no existen.
+
+    La sesión solo guarda la identidad del usuario y el id de su borrador;
+    los registros del mes, el historial y los fenómenos y nubes que se van
+    agregando viven en el servidor.
+    """
+    with etapa("sesion_init"):
+        session.pop("registros", None)   # cookies de versiones anteriores
+        session.pop("historial", None)
+        if "borrador" not in session:
+            session["borrador"] = secrets.token_urlsafe(16)
+        if "fenomenos_lista" in session or "nubes_lista" in session:
+            # Borrador de una cookie anterior: pasa al servidor
+            borradores.guardar(session["borrador"], session.pop("fenomenos_lista", None) or [],
+                               session.pop("nubes_lista", None) or [])
+        if "ultimo_metar" not in session:
+            session["ultimo_metar"] = None
+        if "ultimo_tipo" not in session:
+            session["ultimo_tipo"] = None
+        if session.get("estacion") not in estaciones():
+            session["estacion"] = ESTACION
 
 
 # ─────────────────────────────────────────────
 # ARCHIVOS EXCEL
 # ─────────────────────────────────────────────
-def obtener_nombre_archivo():
-    ahora = datetime.now(timezone.utc)
-    return f"SPJC_METAR_{ahora.strftime('%Y_%m')}.xlsx"
+def obtener_mes():
+    return datetime.now(timezone.utc).strftime("%Y_%m")
 
-def cargar_registros_mes():
-    archivo = DIRECTORIO_DATOS / obtener_nombre_archivo()
-    if archivo.exists():
-        try:
-            df = pd.read_excel(archivo, sheet_name="METAR SPJC")
-            registros = []
-            for _, row in df.iterrows():
-                r = row.to_dict()
-                r["Día"]           = str(r.get("DIA",  "")).zfill(2)
-                r["Hora"]          = str(r.get("HORA", "")).zfill(4)
-                r["Tipo"]          = r.get("TIPO", "")
-                r["METAR_Completo"]= r.get("METAR", "")
-                registros.append(r)
-            return registros
-        except Exception:
-            return []
-    return []
+def instante_observacion(mes, dia, hora):
+    """Segundos epoch (UTC) de la observación; None si la fecha no existe."""
+    try:
+        anio, numero = map(int, mes.split("_"))
+        return datetime(anio, numero, int(dia), int(hora[:2]), int(hora[2:]),
+                        tzinfo=timezone.utc).timestamp()
+    except (ValueError, TypeError):
+        return None
 
-def guardar_registros_mes(registros):
-    if not registros:
-        return
+def obtener_nombre_archivo(mes=None, estacion=ESTACION):
+    return f"{estacion}_METAR_{mes or obtener_mes()}.xlsx"
+
+def directorio_estacion(estacion=ESTACION):
+    return DIRECTORIO_DATOS / estacion
+
+def archivo_excel(mes=None, estacion=ESTACION):
+    """Excel del mes. Los de SPJC de versiones anteriores estaban sueltos en
+    datos_metar/: se siguen leyendo ahí hasta que el mes se reescriba."""
+    nombre  = obtener_nombre_archivo(mes, estacion)
+    archivo = directorio_estacion(estacion) / nombre
+    if estacion == ESTACION and not archivo.exists() and (DIRECTORIO_DATOS / nombre).exists():
+        return DIRECTORIO_DATOS / nombre
+    return archivo
+
+def meses_excel(estacion=ESTACION):
+    """Meses AAAA_MM que tienen Excel en disco."""
+    prefijo = f"{estacion}_METAR_"
+    carpetas = [directorio_estacion(estacion)] + ([DIRECTORIO_DATOS] if estacion == ESTACION else [])
+    return sorted({x.stem[len(prefijo):] for c in carpetas for x in c.glob(f"{prefijo}*.xlsx")})
+
+def meses_entre(desde, hasta):
+    """Meses AAAA_MM de `desde` a `hasta`, ambos incluidos."""
+    anio, mes = map(int, desde.split("_"))
+    salida = []
+    while f"{anio:04d}_{mes:02d}" <= hasta:
+        salida.append(f"{anio:04d}_{mes:02d}")
+        anio, mes = (anio + 1, 1) if mes == 12 else (anio, mes + 1)
+    return salida
+
+# Meses ya leídos: ruta -> (mtime_ns, tamaño, registros), los más usados
+# al final; solo se guardan los últimos MAX_MESES_CACHE (LRU)
+MAX_MESES_CACHE = 4
+_cache_meses = OrderedDict()
+_cache_meses_lock = threading.Lock()
+
+def cargar_registros_mes(mes=None, estacion=ESTACION):
+    """Lee el Excel del mes; solo vuelve a leerlo si cambió en disco."""
+    archivo = archivo_excel(mes, estacion)
     try:
-        from openpyxl.utils import get_column_letter
-        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+        st = archivo.stat()
+    except OSError:
+        return []
+    clave = str(archivo.resolve())
+    with _cache_meses_lock:
+        en_cache = _cache_meses.get(clave)
+        if en_cache:
+            _cache_meses.move_to_end(clave)
+    if en_cache and en_cache[:2] == (st.st_mtime_ns, st.st_size):
+        return list(en_cache[2])
+    try:
+        with etapa("excel_leer"):
+            registros = _leer_excel_mes(archivo, estacion)
+    except Exception:
+        return []
+    with _cache_meses_lock:
+        _cache_meses[clave] = (st.st_mtime_ns, st.st_size, registros)
+        _cache_meses.move_to_end(clave)
+        while len(_cache_meses) > MAX_MESES_CACHE:
+            _cache_meses.popitem(last=False)
+    return list(registros)
 
-        archivo = DIRECTORIO_DATOS / obtener_nombre_archivo()
-        datos   = []
-        for r in registros:
-            datos.append({
-                "DIA":           str(r.get("Día",  "")).zfill(2),
-                "HORA":          str(r.get("Hora", "")).zfill(4),
-                "TIPO":          r.get("Tipo", ""),
-                "DIR VIENTO":    r.get("Dirección_Viento", ""),
-                "INTENSIDAD":    r.get("Intensidad_Viento", ""),
-                "VARIACION":     r.get("Variación_Viento", ""),
-                "VIS (ORIGINAL)":r.get("Visibilidad_Original", ""),
-                "VIS (CODIGO)":  r.get("Visibilidad_Metros", ""),
-                "VIS MIN":       r.get("Visibilidad_Mínima", ""),
-                "RVR":           r.get("RVR", ""),
-                "FENOMENO":      r.get("Fenómeno_Texto", ""),
-                "WX":            r.get("Fenómeno_Código", ""),
-                "NUBOSIDAD":     r.get("Nubes_Texto", ""),
-                "CLD":           r.get("Nubes_Código", ""),
-                "TEMP °C":       r.get("Temperatura", ""),
-                "ROCÍO °C":      r.get("Punto_Rocío", ""),
-                "HR %":          r.get("Humedad_Relativa_%", ""),
-                "QNH":           r.get("QNH", ""),
-                "PRESION":       r.get("Presión_Estación", ""),
-                "RMK":           r.get("Info_Suplementaria", ""),
-                "METAR":         r.get("METAR_Completo", ""),
-            })
-        df = pd.DataFrame(datos).sort_values(["DIA", "HORA"])
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            df.to_excel(writer, sheet_name="METAR SPJC", index=False)
-            ws = writer.sheets["METAR SPJC"]
-            for col in range(1, len(df.columns) + 1):
-                letter  = get_column_letter(col)
-                max_len = max(
-                    (len(str(ws.cell(row=r, column=col).value or ""))
-                     for r in range(1, min(len(datos)+2, 102))), default=8)
-                ws.column_dimensions[letter].width = min(max_len + 3, 80)
-            hf = Font(name="Calibri", size=11, bold=True, color="FFFFFF")
-            hb = PatternFill(start_color="0B3D91", end_color="0B3D91", fill_type="solid")
-            ha = Alignment(horizontal="center", vertical="center")
-            for col in range(1, len(df.columns) + 1):
-                c = ws.cell(row=1, column=col)
-                c.font, c.fill, c.alignment = hf, hb, ha
-            ws.row_dimensions[1].height = 30
-            border = Border(
-                left=Side(style="thin", color="CCCCCC"),
-                right=Side(style="thin", color="CCCCCC"),
-                top=Side(style="thin", color="CCCCCC"),
-                bottom=Side(style="thin", color="CCCCCC"),
-            )
-            for row in range(2, len(datos) + 2):
-                tipo_r = ws.cell(row=row, column=3).value
-                for col in range(1, len(df.columns) + 1):
-                    c = ws.cell(row=row, column=col)
-                    c.border    = border
-                    c.alignment = Alignment(horizontal="center", vertical="center")
-                    if tipo_r == "SPECI":
-                        c.fill = PatternFill(start_color="FFE699", end_color="FFE699", fill_type="solid")
-                        c.font = Font(name="Calibri", size=10, bold=True)
-                    else:
-                        c.font = Font(name="Calibri", size=10)
-            ws.freeze_panes = "A2"
-        output.seek(0)
-        with open(archivo, "wb") as f:
-            f.write(output.getvalue())
+def _leer_excel_mes(archivo, estacion):
+    import pandas as pd
+    # Conversión por columnas; nada de iterrows()
+    df = pd.read_excel(archivo, sheet_name=f"METAR {estacion}")
+    df = df.reindex(columns=list(COLUMNAS_EXCEL))
+    df = df.astype(object).where(df.notna(), "")
+    df["DIA"]  = df["DIA"].astype(str).str.zfill(2)
+    df["HORA"] = df["HORA"].astype(str).str.zfill(4)
+    return [RegistroMetar.desde_fila_excel(fila)
+            for fila in df.itertuples(index=False, name=None)]
+
+def guardar_registros_mes(registros, mes=None, estacion=ESTACION, banderas=None):
+    """Reescribe el Excel del mes; devuelve False si no se pudo guardar.
+
+    Un mes vacío (p. ej. después de /limpiar_memoria) queda con solo el
+    encabezado, para que no sobreviva el Excel anterior. Con `banderas` (de
+    control_calidad) se agrega al final la columna CONTROL CALIDAD; al leer
+    el Excel se ignora."""
+    if not isinstance(registros, RegistrosMes):
+        registros = RegistrosMes(registros)
+    try:
+        from exportador_excel import escribir_libro
+        archivo = directorio_estacion(estacion) / obtener_nombre_archivo(mes, estacion)
+        archivo.parent.mkdir(parents=True, exist_ok=True)
+        filas, columnas = (r.a_fila_excel() for r in registros), COLUMNAS_EXCEL
+        if banderas is not None:
+            filas = (r.a_fila_excel() + [control_calidad.texto(banderas.get(r.clave))]
+                     for r in registros)
+            columnas = COLUMNAS_EXCEL + (control_calidad.COLUMNA,)
+        with etapa("excel_escribir"):
+            escribir_libro(filas, archivo, columnas, hoja=f"METAR {estacion}")
+        bytes_excel.fijar(archivo.stat().st_size, estacion=estacion, mes=mes or obtener_mes())
+        return True
     except Exception as e:
         print(f"Error guardando Excel: {e}")
+        return False
 
 
 # ─────────────────────────────────────────────
-# LÓGICA METAR (mismas funciones que antes)
+# REGISTROS DEL MES
 # ─────────────────────────────────────────────
-def redondear_metar(valor):
-    try:
-        return int(Decimal(str(valor)).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
-    except Exception:
-        return int(round(float(valor)))
-
-def procesar_viento(direccion, intensidad, variacion):
-    dir_int = int(direccion)
-    intensidad_str = str(intensidad).upper().strip()
-    if dir_int == 0 and intensidad_str == "00":
-        return "00000KT"
-    if "G" in intensidad_str:
-        partes = intensidad_str.split("G")
-        intensidad_metar = f"{int(partes[0]):02d}G{int(partes[1]):02d}"
-        int_base = int(partes[0])
-    else:
-        int_base = int(intensidad_str)
-        intensidad_metar = f"{int_base:02d}"
-    if not variacion:
-        return f"{dir_int:03d}{intensidad_metar}KT"
-    try:
-        variacion = variacion.upper().replace(" ", "")
-        if "V" not in variacion:
-            return f"{dir_int:03d}{intensidad_metar}KT"
-        desde, hasta = map(int, variacion.split("V"))
-        diff1 = abs(hasta - desde)
-        diferencia = diff1 if desde < hasta else 360 - diff1
-        if diferencia < 60:
-            return f"{dir_int:03d}{intensidad_metar}KT"
-        if diferencia >= 180 or int_base < 3:
-            return f"VRB{intensidad_metar}KT"
-        d1, d2 = (desde, hasta) if desde < hasta else (hasta, desde)
-        return f"{dir_int:03d}{intensidad_metar}KT {d1:03d}V{d2:03d}"
-    except Exception:
-        return f"{dir_int:03d}{intensidad_metar}KT"
+class RegistrosMes:
+    """Registros de un mes con índice por (día, hora) y orden cronológico.
 
-def convertir_visibilidad(vis_texto):
-    vis_texto = vis_texto.strip().upper()
-    if not vis_texto:
-        raise ValueError("Visibilidad es obligatoria")
-    try:
-        if vis_texto.endswith("KM"):
-            km = float(vis_texto[:-2])
-            return 9999 if km >= 10 else int(km * 1000)
-        elif vis_texto.endswith("M"):
-            return int(vis_texto[:-1])
-        else:
-            metros = int(vis_texto)
-            return 9999 if metros >= 10000 else metros
-    except Exception:
-        raise ValueError("Formato de visibilidad inválido")
-
-def procesar_visibilidad_minima(vis_min_texto, vis_m):
-    if not vis_min_texto:
-        return "", ""
-    vis_min_texto = vis_min_texto.strip().upper()
-    cuadrante = ""
-    valor = vis_min_texto
-    for cq in ["NW", "NE", "SW", "SE", "N", "S", "E", "W"]:
-        if vis_min_texto.endswith(cq):
-            cuadrante = cq
-            valor = vis_min_texto[:-len(cq)]
-            break
+    El índice es un dict; el orden se mantiene con una lista de claves
+    ordenada (bisect), así que no hace falta reordenar al guardar. Los
+    reportes llegan casi siempre en orden, y entonces insertar es añadir
+    al final.
+    """
+
+    def __init__(self, registros=()):
+        self._por_clave = {}
+        self._claves    = []
+        for r in registros:
+            self.actualizar_o_insertar(r)
+
+    @staticmethod
+    def clave(dia, hora):
+        return str(dia).zfill(2), str(hora).zfill(4)
+
+    def actualizar_o_insertar(self, nuevo):
+        clave = nuevo.clave
+        existia = clave in self._por_clave
+        self._por_clave[clave] = nuevo
+        if not existia:
+            insort(self._claves, clave)
+        return "actualizado" if existia else "insertado"
+
+    def obtener(self, dia, hora, tipo=None):
+        r = self._por_clave.get(self.clave(dia, hora))
+        if r is not None and tipo and r.tipo != tipo:
+            return None
+        return r
+
+    def rango(self, desde, hasta):
+        """Registros con desde <= (día, hora) <= hasta, en orden."""
+        i = bisect_left(self._claves, self.clave(*desde))
+        j = bisect_right(self._claves, self.clave(*hasta))
+        return [self._por_clave[k] for k in self._claves[i:j]]
+
+    def anterior(self, clave, tipo=None):
+        """Registro inmediatamente anterior a `clave` (del `tipo`, si se da)."""
+        claves = self._claves
+        i = bisect_left(claves, self.clave(*clave))
+        while i > 0:
+            i -= 1
+            r = self._por_clave[claves[i]]
+            if tipo is None or r.tipo == tipo:
+                return r
+        return None
+
+    def siguiente(self, clave, tipo=None):
+        """Registro inmediatamente posterior a `clave` (del `tipo`, si se da)."""
+        claves = self._claves
+        i = bisect_right(claves, self.clave(*clave))
+        while i < len(claves):
+            r = self._por_clave[claves[i]]
+            if tipo is None or r.tipo == tipo:
+                return r
+            i += 1
+        return None
+
+    def __iter__(self):
+        # Copia de las claves: otro hilo puede insertar mientras se recorre
+        por_clave = self._por_clave
+        return (por_clave[k] for k in list(self._claves))
+
+    def __len__(self):
+        return len(self._claves)
+
+
+def actualizar_o_insertar(registros, nuevo):
+    """Inserta o reemplaza `nuevo` (misma día/hora) en un RegistrosMes."""
+    return registros.actualizar_o_insertar(nuevo)
+
+
+# ─────────────────────────────────────────────
+# ALMACÉN DE OBSERVACIONES (lado servidor)
+# ─────────────────────────────────────────────
+class AlmacenObservaciones:
+    """Registros de una estación compartidos por todos los usuarios, en SQLite.
+
+    Cada estación tiene su propio archivo (y su propio candado de
+    escritura). Cada observación se guarda con clave (estación, mes, día,
+    hora). La primera vez que se consulta un mes se importa desde su Excel.
+
+    Cada cambio incrementa la `version` del mes en la misma transacción;
+    `version_excel` indica hasta qué versión está escrito el Excel. Los
+    meses leídos se guardan en memoria como RegistrosMes y se reutilizan
+    mientras su versión no cambie.
+    """
+
+    _ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS observaciones (
+            estacion   TEXT NOT NULL,
+            mes        TEXT NOT NULL,
+            dia        TEXT NOT NULL,
+            hora       TEXT NOT NULL,
+            tipo       TEXT NOT NULL,
+            datos      TEXT NOT NULL,
+            actualizado REAL NOT NULL,
+            PRIMARY KEY (estacion, mes, dia, hora)
+        );
+        CREATE INDEX IF NOT EXISTS observaciones_actualizado
+            ON observaciones (estacion, actualizado);
+        CREATE TABLE IF NOT EXISTS meses (
+            estacion      TEXT NOT NULL,
+            mes           TEXT NOT NULL,
+            version       INTEGER NOT NULL DEFAULT 0,
+            version_excel INTEGER NOT NULL DEFAULT 0,
+            guardado      REAL,
+            PRIMARY KEY (estacion, mes)
+        );
+    """
+
+    def __init__(self, ruta, estacion=ESTACION):
+        self.ruta   = Path(ruta)
+        self.estacion = estacion
+        self._local = threading.local()
+        self._cache = {}                       # mes -> (versión, RegistrosMes)
+        self._cache_lock = threading.Lock()
+        self._escritura  = threading.Lock()
+        # Funciones f(estación, mes, días o None, versión anterior, versión nueva)
+        # que se llaman después de cada cambio confirmado
+        self.observadores = []
+
+    def _conexion(self):
+        # Una conexión por hilo: sqlite3 no permite compartirlas. El archivo
+        # y las tablas se crean con la primera, no al importar el módulo.
+        con = getattr(self._local, "con", None)
+        if con is None:
+            self.ruta.parent.mkdir(parents=True, exist_ok=True)
+            con = sqlite3.connect(str(self.ruta), timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(self._ESQUEMA)
+            self._local.con = con
+        return con
+
+    def _asegurar_mes(self, con, mes):
+        estacion = self.estacion
+        existe = ("SELECT 1 FROM meses WHERE estacion=? AND mes=?", (estacion, mes))
+        if con.execute(*existe).fetchone():
+            return
+        registros = cargar_registros_mes(mes, estacion)
+        # Las filas importadas cuentan como guardadas cuando se escribió el
+        # Excel (no ahora), o a la hora de su observación si es anterior: así
+        # no aparecen como recién emitidas en el historial
+        archivo = archivo_excel(mes, estacion)
+        guardado = archivo.stat().st_mtime if registros and archivo.exists() else time.time()
+        # Otro proceso pudo importar el mes (y guardar observaciones nuevas)
+        # mientras se leía el Excel: se vuelve a comprobar con la base
+        # bloqueada y las filas del Excel nunca reemplazan a las del almacén.
+        propia = not con.in_transaction
+        if propia:
+            con.execute("BEGIN IMMEDIATE")
+        try:
+            if not con.execute(*existe).fetchone():
+                con.execute("INSERT INTO meses (estacion, mes) VALUES (?, ?)",
+                            (estacion, mes))
+                con.executemany(
+                    "INSERT OR IGNORE INTO observaciones VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(estacion, mes, r.dia, r.hora, r.tipo, r.a_json(),
+                      self._guardado(mes, r, guardado)) for r in registros])
+            if propia:
+                con.commit()
+        except BaseException:
+            if propia:
+                con.rollback()
+            raise
+
+    @staticmethod
+    def _guardado(mes, registro, ahora):
+        """`ahora`, o la hora de la observación si es anterior."""
+        observado = instante_observacion(mes, registro.dia, registro.hora)
+        return ahora if observado is None else min(ahora, observado)
+
+    def _escribir(self, con, mes, registro, por_observacion=False):
+        guardado = time.time()
+        if por_observacion:
+            guardado = self._guardado(mes, registro, guardado)
+        con.execute(
+            "INSERT OR REPLACE INTO observaciones VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.estacion, mes, registro.dia, registro.hora, registro.tipo,
+             registro.a_json(), guardado))
+
+    def _nueva_version(self, con, mes, cambios=1):
+        con.execute("UPDATE meses SET version = version + ? "
+                    "WHERE estacion=? AND mes=?", (cambios, self.estacion, mes))
+
+    def _cargar(self, con, mes):
+        """(version, version_excel, RegistrosMes) del mes, con caché."""
+        self._asegurar_mes(con, mes)
+        version, version_excel = con.execute(
+            "SELECT version, version_excel FROM meses WHERE estacion=? AND mes=?",
+            (self.estacion, mes)).fetchone()
+        with self._cache_lock:
+            en_cache = self._cache.get(mes)
+        if en_cache is None or en_cache[0] != version:
+            filas = con.execute(
+                "SELECT datos FROM observaciones WHERE estacion=? AND mes=? "
+                "ORDER BY dia, hora", (self.estacion, mes)).fetchall()
+            en_cache = (version, RegistrosMes(RegistroMetar.desde_json(d) for (d,) in filas))
+            with self._cache_lock:
+                self._cache[mes] = en_cache
+        return version, version_excel, en_cache[1]
+
+    def registros(self, mes):
+        """RegistrosMes del mes (compartido: no modificarlo desde fuera)."""
+        return self.con_version(mes)[1]
+
+    def con_version(self, mes):
+        """(version, RegistrosMes) leídos juntos."""
+        with self._conexion() as con:
+            version, _, registros = self._cargar(con, mes)
+        return version, registros
+
+    def contar(self, mes):
+        return len(self.registros(mes))
+
+    def actualizar_o_insertar(self, mes, nuevo):
+        """Guarda el registro; devuelve "actualizado" si ya existía esa hora."""
+        return self.actualizar_o_insertar_lote(mes, [nuevo], por_observacion=False)[0]
+
+    def actualizar_o_insertar_lote(self, mes, nuevos, por_observacion=True):
+        """Guarda varios registros en una sola transacción.
+
+        Con `por_observacion` (cargas masivas, importaciones) cada fila cuenta
+        como guardada a la hora de su observación si es anterior: rellenar
+        meses pasados no ocupa el historial de los últimos guardados."""
+        if not nuevos:
+            return []
+        with self._escritura, self._conexion() as con:
+            con.execute("BEGIN IMMEDIATE")
+            version, _, registros = self._cargar(con, mes)
+            for r in nuevos:
+                self._escribir(con, mes, r, por_observacion)
+            self._nueva_version(con, mes, len(nuevos))
+            con.commit()
+            acciones = [registros.actualizar_o_insertar(r) for r in nuevos]
+            with self._cache_lock:
+                self._cache[mes] = (version + len(nuevos), registros)
+        claves = {r.clave for r in nuevos}
+        for avisar in self.observadores:
+            avisar(self.estacion, mes, claves, version, version + len(nuevos))
+        return acciones
+
+    def limpiar(self, mes):
+        with self._escritura, self._conexion() as con:
+            con.execute("INSERT OR IGNORE INTO meses (estacion, mes) VALUES (?, ?)",
+                        (self.estacion, mes))
+            con.execute("DELETE FROM observaciones WHERE estacion=? AND mes=?",
+                        (self.estacion, mes))
+            self._nueva_version(con, mes)
+            with self._cache_lock:
+                self._cache.pop(mes, None)
+        for avisar in self.observadores:
+            avisar(self.estacion, mes, None, None, None)
+
+    def recientes(self, horas=24, ahora=None):
+        """Registros de las últimas `horas`, aunque crucen el cambio de mes."""
+        ahora = ahora or datetime.now(timezone.utc)
+        desde = ahora - timedelta(hours=horas)
+        salida = []
+        for mes in sorted({desde.strftime("%Y_%m"), ahora.strftime("%Y_%m")}):
+            ini = (desde.strftime("%d"), desde.strftime("%H%M")) \
+                if mes == desde.strftime("%Y_%m") else ("00", "0000")
+            fin = (ahora.strftime("%d"), ahora.strftime("%H%M")) \
+                if mes == ahora.strftime("%Y_%m") else ("99", "9999")
+            salida.extend(self.registros(mes).rango(ini, fin))
+        return salida
+
+    def vigencia(self):
+        """Suma de las versiones de todos los meses: cambia en cuanto
+        cualquier proceso guarda o limpia algo en la estación."""
+        with self._conexion() as con:
+            self._asegurar_mes(con, obtener_mes())
+            return con.execute("SELECT COALESCE(SUM(version), 0) FROM meses WHERE estacion=?",
+                               (self.estacion,)).fetchone()[0]
+
+    def ultimos_guardados(self, horas=24, maximo=20):
+        """Hasta `maximo` registros guardados en las últimas `horas` (de
+        cualquier mes y por cualquier proceso), en el orden en que se
+        guardaron: el último es el más reciente. Las cargas masivas cuentan
+        a la hora de la observación (ver actualizar_o_insertar_lote())."""
+        with self._conexion() as con:
+            filas = con.execute(
+                "SELECT datos FROM observaciones WHERE estacion=? AND actualizado >= ? "
+                "ORDER BY actualizado DESC, mes DESC, dia DESC, hora DESC LIMIT ?",
+                (self.estacion, time.time() - horas * 3600, maximo)).fetchall()
+        return [RegistroMetar.desde_json(d) for (d,) in reversed(filas)]
+
+    def instantanea(self, mes):
+        """(version, version_excel, registros); registros es None si el Excel
+        ya está al día."""
+        with self._conexion() as con:
+            version, version_excel, registros = self._cargar(con, mes)
+        if version <= version_excel:
+            return version, version_excel, None
+        return version, version_excel, registros
+
+    def marcar_guardado(self, mes, version):
+        with self._conexion() as con:
+            con.execute(
+                "UPDATE meses SET version_excel = MAX(version_excel, ?), guardado = ? "
+                "WHERE estacion=? AND mes=?", (version, time.time(), self.estacion, mes))
+
+    def meses_pendientes(self):
+        """Meses cuyo Excel quedó detrás del almacén (p. ej. tras una caída)."""
+        with self._conexion() as con:
+            return [mes for (mes,) in con.execute(
+                "SELECT mes FROM meses WHERE estacion=? AND version > version_excel",
+                (self.estacion,))]
+
+    def versiones(self, mes):
+        """(version del almacén, version escrita en el Excel) del mes."""
+        with self._conexion() as con:
+            self._asegurar_mes(con, mes)
+            return con.execute(
+                "SELECT version, version_excel FROM meses WHERE estacion=? AND mes=?",
+                (self.estacion, mes)).fetchone()
+
+    def iterar(self, mes, desde=None, hasta=None, lote=500):
+        """Registros del mes en orden, leídos de a `lote` con una conexión
+        propia de solo lectura (sirve para respuestas en streaming).
+        `desde` y `hasta` son claves (día, hora) opcionales, incluidas."""
+        sql, args = "SELECT datos FROM observaciones WHERE estacion=? AND mes=?", [self.estacion, mes]
+        if desde:
+            sql += " AND (dia, hora) >= (?, ?)"
+            args += desde
+        if hasta:
+            sql += " AND (dia, hora) <= (?, ?)"
+            args += hasta
+        con = sqlite3.connect(f"file:{self.ruta}?mode=ro", uri=True, timeout=30)
+        try:
+            cursor = con.execute(sql + " ORDER BY dia, hora", args)
+            while True:
+                filas = cursor.fetchmany(lote)
+                if not filas:
+                    return
+                for (datos,) in filas:
+                    yield RegistroMetar.desde_json(datos)
+        finally:
+            con.close()
+
+    def fuentes_rango(self, desde, hasta):
+        """(mes, origen, versión) de los meses con datos entre `desde` y
+        `hasta` (AAAA_MM). El origen es "almacen", o la ruta del Excel si el
+        mes todavía no se importó; la versión cambia con cada modificación.
+
+        Un mes importado manda aunque esté vacío (se limpió): su Excel ya no
+        es la fuente."""
+        with self._conexion() as con:
+            en_almacen = {mes: (version, hay) for mes, version, hay in con.execute(
+                "SELECT m.mes, m.version, EXISTS (SELECT 1 FROM observaciones o "
+                "WHERE o.estacion=m.estacion AND o.mes=m.mes) "
+                "FROM meses m WHERE m.estacion=? AND m.mes BETWEEN ? AND ?",
+                (self.estacion, desde, hasta))}
+        fuentes = []
+        for mes in meses_entre(desde, hasta):
+            if mes in en_almacen:
+                version, hay = en_almacen[mes]
+                if hay:
+                    fuentes.append((mes, "almacen", version))
+                continue
+            archivo = archivo_excel(mes, self.estacion)
+            if archivo.exists():
+                fuentes.append((mes, str(archivo.resolve()), archivo.stat().st_mtime_ns))
+        return fuentes
+
+    def estado_persistencia(self):
+        """(cambios sin escribir en Excel, hora del último guardado)."""
+        with self._conexion() as con:
+            return con.execute(
+                "SELECT COALESCE(SUM(version - version_excel), 0), MAX(guardado) "
+                "FROM meses WHERE estacion=?", (self.estacion,)).fetchone()
+
+
+def ruta_base(estacion=ESTACION):
+    """Base SQLite de la estación. Las instalaciones anteriores tenían la de
+    SPJC en datos_metar/observaciones.db: si existe, se sigue usando."""
+    ruta     = directorio_estacion(estacion) / "observaciones.db"
+    anterior = DIRECTORIO_DATOS / "observaciones.db"
+    if estacion == ESTACION and not ruta.exists() and anterior.exists():
+        return anterior
+    return ruta
+
+
+estadisticas = CacheEstadisticas()
+calidad      = control_calidad.ControlCalidad()
+# Un pool de reportes por worker para todas las estaciones: MAX_EXPORTACIONES
+# es el límite de cada worker, no de cada estación
+pool_exportaciones = PoolExportaciones(MAX_EXPORTACIONES)
+atexit.register(pool_exportaciones.detener)
+
+
+# ─────────────────────────────────────────────
+# ESCRITURA DIFERIDA DEL EXCEL
+# ─────────────────────────────────────────────
+class EscritorExcel:
+    """Regenera los Excel mensuales de una estación en un hilo de fondo.
+
+    La observación ya queda confirmada en el almacén cuando se responde al
+    operador; aquí se agrupan los cambios de cada ventana de `demora`
+    segundos en una sola regeneración del libro por mes.
+    """
+
+    def __init__(self, almacen, demora=DEMORA_ESCRITURA):
+        self.almacen     = almacen
+        self.demora      = demora
+        self.ultimo_error = None
+        self._pendientes = set()
+        self._cond       = threading.Condition()
+        self._escribiendo = threading.Lock()
+        self._hilo       = None
+        self._detenido   = False
+
+    def marcar(self, mes):
+        """Anota que el mes cambió; se escribirá en la próxima ventana."""
+        with self._cond:
+            if self._hilo is None:
+                # openpyxl borra sus temporales en su propio atexit; importándolo
+                # antes de registrar el nuestro, el vaciado final corre primero
+                importlib.import_module("exportador_excel")
+                atexit.register(self.detener)
+                self._pendientes.update(self.almacen.meses_pendientes())
+                self._hilo = threading.Thread(target=self._bucle, daemon=True,
+                                              name=f"escritor-excel-{self.almacen.estacion}")
+                self._hilo.start()
+            self._pendientes.add(mes)
+            self._cond.notify()
+
+    def _bucle(self):
+        while True:
+            with self._cond:
+                while not self._pendientes and not self._detenido:
+                    self._cond.wait()
+                if self._detenido:
+                    return
+            time.sleep(self.demora)   # deja llegar el resto de la ráfaga
+            self.vaciar()
+
+    def vaciar(self, mes=None):
+        """Escribe ahora los meses pendientes, o solo `mes` si se indica."""
+        with self._escribiendo:
+            with self._cond:
+                if mes is None:
+                    lote, self._pendientes = self._pendientes, set()
+                else:
+                    lote = {mes}
+                    self._pendientes.discard(mes)
+            for m in sorted(lote):
+                self._escribir_mes(m)
+
+    def _escribir_mes(self, m):
+        # Con varios workers cada uno tiene su escritor: el candado del
+        # archivo hace que la instantánea se tome y se escriba sin que otro
+        # proceso intercale una versión más vieja.
+        est = self.almacen.estacion
+        directorio = directorio_estacion(est)
+        directorio.mkdir(parents=True, exist_ok=True)
+        with bloqueo_archivo(directorio / f"{obtener_nombre_archivo(m, est)}.lock"):
+            version, version_excel, registros = self.almacen.instantanea(m)
+            if registros is None:
+                return
+            banderas = calidad.obtener(est, m, version, registros)
+            if guardar_registros_mes(registros, m, est, banderas):
+                self.almacen.marcar_guardado(m, version)
+                self.ultimo_error = None
+                try:
+                    with etapa("archivo_columnar"):
+                        archivo_columnar.escribir_mes(ARCHIVO_COLUMNAR, est, m, registros)
+                except Exception as e:
+                    print(f"Error actualizando archivo columnar: {e}")
+                return
+        self.ultimo_error = f"No se pudo guardar {obtener_nombre_archivo(m, est)}"
+        with self._cond:
+            self._pendientes.add(m)
+
+    def detener(self):
+        """Vacía lo pendiente antes de terminar el proceso."""
+        with self._cond:
+            self._detenido = True
+            self._cond.notify()
+        self.vaciar()
+
+    def estado(self):
+        pendientes, guardado = self.almacen.estado_persistencia()
+        return {
+            "cambios_pendientes": pendientes,
+            "ultimo_guardado": (datetime.fromtimestamp(guardado, timezone.utc)
+                                .strftime("%Y-%m-%d %H:%M:%SZ") if guardado else None),
+            "error": self.ultimo_error,
+        }
+
+
+
+# ─────────────────────────────────────────────
+# HISTORIAL COMPARTIDO
+# ─────────────────────────────────────────────
+class BoletinesRecientes:
+    """Últimos boletines guardados en la estación, el más nuevo primero.
+
+    El almacén es la fuente: `origen()` da los registros de las últimas 24 h
+    y `vigencia()` la suma de versiones del almacén. Cada consulta pide la
+    vigencia (una consulta a la base) y, si cambió, vuelve a leer el origen;
+    así todos los workers muestran lo mismo, incluido lo que emitió otro, y
+    el ETag sale de esa vigencia.
+    """
+
+    def __init__(self, origen, vigencia, maximo=20, estacion=ESTACION):
+        self.maximo   = maximo
+        self.estacion = estacion
+        self._origen  = origen
+        self._vigencia = vigencia
+        self._vista   = None                   # vigencia con la que se llenó
+        self._boletines = OrderedDict()        # (día, hora) -> texto; el último es el más nuevo
+        self._lock    = threading.Lock()
+
+    def _sembrar(self):
+        actual = self._vigencia()
+        if actual != self._vista:
+            self._vista = actual
+            self._boletines.clear()
+            for r in self._origen()[-self.maximo:]:
+                self._boletines[r.clave] = r.metar
+
+    def agregar(self, registro):
+        """Pone al frente un boletín recién guardado en el almacén."""
+        with self._lock:
+            self._sembrar()
+            self._boletines.pop(registro.clave, None)
+            self._boletines[registro.clave] = registro.metar
+            if len(self._boletines) > self.maximo:
+                self._boletines.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._vista = None
+            self._boletines.clear()
+
+    def instantanea(self, n=None):
+        """(etag, lista de textos del más nuevo al más viejo)."""
+        with self._lock:
+            self._sembrar()
+            textos = list(reversed(self._boletines.values()))
+            etag = f"{self.estacion}-hist-v{self._vista}"
+        return etag, textos[:n]
+
+
+
+# ─────────────────────────────────────────────
+# ESTACIONES
+# ─────────────────────────────────────────────
+class Aerodromo:
+    """Todo lo de una estación: almacén, escritor del Excel, reportes,
+    historial y difusión en vivo (SSE). Cada una tiene su base, sus
+    archivos y sus candados, así que la actividad de un aeródromo no frena
+    las escrituras ni las exportaciones de otro."""
+
+    def __init__(self, codigo):
+        self.codigo   = codigo
+        self.almacen  = AlmacenObservaciones(ruta_base(codigo), codigo)
+        self.almacen.observadores += [estadisticas.invalidar, calidad.invalidar]
+        self.escritor = EscritorExcel(self.almacen)
+        self.exportaciones = ColaExportaciones(directorio_estacion(codigo) / "reportes",
+                                               self.almacen.ruta, pool_exportaciones)
+        self.historial = BoletinesRecientes(
+            lambda: self.almacen.ultimos_guardados(24, HISTORIAL_MAXIMO),
+            self.almacen.vigencia, maximo=HISTORIAL_MAXIMO, estacion=codigo)
+        self.difusor   = Difusor()
+
+    def anunciar(self, mes, registro, accion):
+        """Pasa un boletín recién guardado al historial y a las pantallas conectadas."""
+        self.historial.agregar(registro)
+        self.difusor.publicar("metar", {
+            "estacion": self.codigo,
+            "mes":      mes,
+            "dia":      registro.dia,
+            "hora":     registro.hora,
+            "tipo":     registro.tipo,
+            "accion":   accion,
+            "metar":    registro.metar,
+        })
+
+
+def banderas_mes(aero, mes):
+    """Banderas de control de calidad del mes: {(día, hora): [banderas]}."""
+    version, registros = aero.almacen.con_version(mes)
+    return calidad.obtener(aero.codigo, mes, version, registros)
+
+
+_aerodromos = {}
+_aerodromos_lock = threading.Lock()
+
+def aerodromo(codigo=ESTACION):
+    """Servicios de la estación, creados la primera vez que se piden;
+    KeyError si no está en estaciones.json."""
+    reglas(codigo)
+    with _aerodromos_lock:
+        if codigo not in _aerodromos:
+            _aerodromos[codigo] = Aerodromo(codigo)
+        return _aerodromos[codigo]
+
+# Los de la estación por defecto, para la línea de comandos y los benchmarks
+principal     = aerodromo(ESTACION)
+almacen       = principal.almacen
+escritor      = principal.escritor
+exportaciones = principal.exportaciones
+historial     = principal.historial
+difusor       = principal.difusor
+
+
+# ─────────────────────────────────────────────
+# BORRADORES DEL FORMULARIO
+# ─────────────────────────────────────────────
+MAX_FENOMENOS = 3
+MAX_NUBES     = 4
+
+class Borradores:
+    """Fenómenos y nubes que cada operador va agregando antes de generar el
+    boletín, guardados en SQLite por id de sesión.
+
+    Un clic es una lectura y una escritura de una fila: no hay que reenviar
+    la cookie ni volver a dibujar la página, y con varios workers todos ven
+    el mismo borrador.
+    """
+
+    _ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS borradores (
+            id          TEXT PRIMARY KEY,
+            fenomenos   TEXT NOT NULL,
+            nubes       TEXT NOT NULL,
+            actualizado REAL NOT NULL
+        );
+    """
+
+    def __init__(self, ruta):
+        self.ruta   = Path(ruta)
+        self._local = threading.local()
+
+    def _conexion(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            self.ruta.parent.mkdir(parents=True, exist_ok=True)
+            con = sqlite3.connect(str(self.ruta), timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(self._ESQUEMA)
+            self._local.con = con
+        return con
+
+    @staticmethod
+    def _leer(con, id_borrador):
+        fila = con.execute("SELECT fenomenos, nubes FROM borradores WHERE id=?",
+                           (id_borrador,)).fetchone()
+        return (json.loads(fila[0]), json.loads(fila[1])) if fila else ([], [])
+
+    @staticmethod
+    def _escribir(con, id_borrador, fenomenos, nubes):
+        con.execute("INSERT OR REPLACE INTO borradores VALUES (?, ?, ?, ?)",
+                    (id_borrador, json.dumps(fenomenos), json.dumps(nubes), time.time()))
+
+    def obtener(self, id_borrador):
+        """(fenómenos, nubes) del borrador; listas vacías si no existe."""
+        return self._leer(self._conexion(), id_borrador)
+
+    def guardar(self, id_borrador, fenomenos, nubes):
+        with self._conexion() as con:
+            self._escribir(con, id_borrador, fenomenos, nubes)
+
+    def modificar(self, id_borrador, cambio):
+        """Aplica cambio(fenómenos, nubes), que modifica las listas, en una
+        sola transacción (dos clics seguidos no se pisan) y las devuelve."""
+        with self._conexion() as con:
+            con.execute("BEGIN IMMEDIATE")
+            fenomenos, nubes = self._leer(con, id_borrador)
+            cambio(fenomenos, nubes)
+            self._escribir(con, id_borrador, fenomenos, nubes)
+        return fenomenos, nubes
+
+    def descartar(self, id_borrador):
+        with self._conexion() as con:
+            con.execute("DELETE FROM borradores WHERE id=?", (id_borrador,))
+
+    def purgar(self, horas=24):
+        """Borra los borradores abandonados (sesiones que no volvieron)."""
+        with self._conexion() as con:
+            con.execute("DELETE FROM borradores WHERE actualizado < ?",
+                        (time.time() - horas * 3600,))
+
+
+borradores = Borradores(DIRECTORIO_DATOS / "borradores.db")
+
+def nube_desde(datos):
+    """Capa del formulario (tipo_nube) o del JSON (tipo); ValueError si no es válida."""
+    nube = {
+        "octas":    int(datos.get("octas", 1)),
+        "tipo":     str(datos.get("tipo_nube") or datos.get("tipo") or "SC").upper(),
+        "altura_m": int(datos.get("altura_m", 300)),
+    }
+    if not 1 <= nube["octas"] <= 8 or nube["tipo"] not in TIPOS_NUBE or nube["altura_m"] < 0:
+        raise ValueError("Capa de nubes inválida")
+    return nube
+
+def agregar_fenomeno_a(codigo):
+    def cambio(fenomenos, nubes):
+        if codigo and codigo not in fenomenos and len(fenomenos) < MAX_FENOMENOS:
+            fenomenos.append(codigo)
+    return cambio
+
+def agregar_nube_a(nube):
+    def cambio(fenomenos, nubes):
+        if len(nubes) < MAX_NUBES:
+            nubes.append(nube)
+    return cambio
+
+def eliminar_de(lista, idx):
+    def cambio(fenomenos, nubes):
+        elegida = fenomenos if lista == "fenomenos" else nubes
+        if 0 <= idx < len(elegida):
+            elegida.pop(idx)
+    return cambio
+
+def editar_borrador(cambio):
+    with etapa("borrador"):
+        return borradores.modificar(session["borrador"], cambio)
+
+def vista_previa(formulario, fenomenos, nubes, estacion=ESTACION):
+    """METAR que daría el formulario con el borrador, sin guardar nada."""
     try:
-        if valor.endswith("KM"):
-            vis_min_m = 9999 if float(valor[:-2]) >= 10 else int(float(valor[:-2]) * 1000)
-        elif valor.endswith("M"):
-            vis_min_m = int(valor[:-1])
+        datos = normalizar_observacion(dict(formulario, fenomenos=fenomenos, nubes=nubes))
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    res = generar_metar(datos, estacion=estacion)
+    return {"success": True, "metar": res["metar"]} if res["success"] \
+        else {"success": False, "error": res["error"]}
+
+
+# ─────────────────────────────────────────────
+# LOTES (carga masiva)
+# ─────────────────────────────────────────────
+CAMPOS_FORMULARIO = (
+    "tipo", "dia", "hora", "dir_viento", "int_viento", "var_viento",
+    "vis", "vis_min", "rvr", "temp", "rocio", "hr", "qnh", "presion",
+    "suplementaria",
+)
+
+def mes_valido(mes):
+    """`mes` es AAAA_MM con un mes de 01 a 12."""
+    return bool(re.fullmatch(r"\d{4}_(0[1-9]|1[0-2])", str(mes)))
+
+def normalizar_observacion(obs, mes=None):
+    """Convierte un dict de entrada (JSON, AWOS...) al formato de /generar.
+
+    Rechaza el tipo, el día (según los días de `mes`) y la hora fuera de
+    rango, que generar_metar() no revisa."""
+    if not isinstance(obs, dict):
+        raise ValueError("Cada observación debe ser un objeto")
+    datos = {c: "" if obs.get(c) is None else str(obs[c]).strip()
+             for c in CAMPOS_FORMULARIO}
+    datos["tipo"] = datos["tipo"].upper() or "METAR"
+    if datos["tipo"] not in ("METAR", "SPECI"):
+        raise ValueError("tipo debe ser METAR o SPECI")
+    anio, numero = map(int, (mes or obtener_mes()).split("_"))
+    dias = calendar.monthrange(anio, numero)[1]
+    if not (datos["dia"].isdigit() and 1 <= int(datos["dia"]) <= dias):
+        raise ValueError(f"dia debe estar entre 01 y {dias:02d}")
+    datos["dia"] = datos["dia"].zfill(2)
+    if isinstance(obs.get("hora"), int):
+        datos["hora"] = f"{obs['hora']:04d}"
+    hora = datos["hora"]
+    if not (len(hora) == 4 and hora.isdigit() and int(hora[:2]) <= 23 and int(hora[2:]) <= 59):
+        raise ValueError("hora debe ser HHMM entre 0000 y 2359")
+    fenomenos = obs.get("fenomenos") or []
+    if isinstance(fenomenos, str):                  # "-RA BR"
+        fenomenos = fenomenos.split()
+    if not isinstance(fenomenos, list) or not all(isinstance(f, str) for f in fenomenos):
+        raise ValueError("fenomenos debe ser una lista de códigos (p. ej. [\"-RA\", \"BR\"])")
+    nubes = obs.get("nubes") or []
+    if not isinstance(nubes, list) or not all(isinstance(n, dict) for n in nubes):
+        raise ValueError("nubes debe ser una lista de capas (objetos)")
+    datos["fenomenos"] = [f.strip() for f in fenomenos if f.strip()]
+    datos["nubes"]     = list(nubes)
+    return datos
+
+def validar_temp_qnh_lote(lista_datos):
+    """validar_temp_qnh() por columnas. Devuelve, por fila, la tupla
+    validada o el ValueError que daría la versión escalar."""
+    import pandas as pd
+    num = pd.DataFrame({c: [d[c] for d in lista_datos] for c in ("temp", "rocio", "qnh")},
+                       dtype=object).apply(pd.to_numeric, errors="coerce")
+    t = num["temp"].to_numpy(dtype=float)
+    r = num["rocio"].to_numpy(dtype=float)
+    q = num["qnh"].to_numpy(dtype=float)
+
+    # Primer error de cada fila, en el mismo orden que validar_temp_qnh()
+    estado = np.select(
+        [np.isnan(t) | np.isnan(r) | np.isnan(q),
+         r > t,
+         ~((-10 <= t) & (t <= 40)),
+         ~((850 <= q) & (q <= 1100))],
+        [1, 2, 3, 4], default=0).tolist()
+    # ROUND_HALF_UP de redondear_metar(): la mitad se aleja del cero
+    t_m = (np.sign(t) * np.floor(np.abs(t) + 0.5)).tolist()
+    r_m = (np.sign(r) * np.floor(np.abs(r) + 0.5)).tolist()
+    q_m = np.trunc(q).tolist()
+    t, r, q = t.tolist(), r.tolist(), q.tolist()
+
+    salida = []
+    for i, e in enumerate(estado):
+        if e == 0:
+            salida.append((t[i], r[i], q[i], int(t_m[i]), int(r_m[i]), int(q_m[i])))
+        elif e == 1:
+            # Texto que pandas no entiende: se decide como siempre, con float()
+            d = lista_datos[i]
+            try:
+                salida.append(validar_temp_qnh(d["temp"], d["rocio"], d["qnh"]))
+            except Exception as err:
+                salida.append(ValueError(str(err)))
+        elif e == 2:
+            salida.append(ValueError(
+                f"Rocío ({r[i]}°C) no puede ser > Temperatura ({t[i]}°C)"))
+        elif e == 3:
+            salida.append(ValueError("Temperatura fuera de rango (-10 a 40°C)"))
         else:
-            vis_min_m = int(valor)
-            vis_min_m = 9999 if vis_min_m >= 10000 else vis_min_m
-        if not (vis_min_m < 1500 or (vis_min_m < vis_m * 0.5 and vis_min_m < 5000)):
-            return "", "No cumple reglas de visibilidad mínima"
-        return f"{vis_min_m:04d}{cuadrante}", ""
-    except Exception:
-        return "", "Formato inválido"
-
-def procesar_rvr(rvr_texto):
-    return rvr_texto.strip() if rvr_texto else ""
-
-def interpretar_nubes_lista(nubes_lista, vis_m, fenomeno):
-    if not nubes_lista:
-        if vis_m >= 9999 and not fenomeno.strip():
-            return "CAVOK"
-        return "NSC"
-    codigos = []
-    for capa in nubes_lista[:4]:
-        octas     = int(capa.get("octas", 0))
-        tipo_nube = capa.get("tipo", "SC").upper()
-        altura_m  = int(capa.get("altura_m", 300))
-        if octas <= 2:   cod = "FEW"
-        elif octas <= 4: cod = "SCT"
-        elif octas <= 7: cod = "BKN"
-        else:            cod = "OVC"
-        altura_ft = max(1, min(round(altura_m / 30), 999))
-        codigo = f"{cod}{altura_ft:03d}"
-        if tipo_nube in ("CB", "TCU"):
-            codigo += tipo_nube
-        if codigo not in codigos:
-            codigos.append(codigo)
-    return " ".join(codigos) if codigos else "NSC"
-
-def validar_info_suplementaria(hora, texto):
-    if not texto or not texto.strip():
-        return False, "Falta información suplementaria obligatoria: precipitación PPxxx"
-    partes = texto.strip().upper().split()
-    tiene_precip = any(
-        p.startswith("PP") and len(p) >= 4
-        and p[2:5].replace("T","").replace("R","").replace("Z","").isdigit()
-        for p in partes
-    )
-    if not tiene_precip:
-        return False, "Falta precipitación: debe incluir PPxxx (ej: PP000, PP001, PPTRZ)"
-    if hora and hora.isdigit() and len(hora) == 4:
-        h = int(hora)
-        if h == 1200 and not any(p.startswith("TN") for p in partes):
-            return False, "Las 12Z requieren temperatura mínima (TNxxx)"
-        if h == 2200 and not any(p.startswith("TX") for p in partes):
-            return False, "Las 22Z requieren temperatura máxima (TXxxx)"
-    return True, ""
-
-def generar_metar(datos):
-    try:
-        if not datos["dir_viento"] or not datos["int_viento"]:
-            raise ValueError("Dirección e intensidad del viento son obligatorias")
-        if not datos["vis"]:
-            raise ValueError("Visibilidad es obligatoria")
-        if not datos["temp"] or not datos["rocio"] or not datos["qnh"]:
-            raise ValueError("Temperatura, Rocío y QNH son obligatorios")
-
-        hora = datos["hora"]
-        if not hora or len(hora) != 4 or not hora.isdigit():
-            raise ValueError("Hora debe ser HHMM (4 dígitos)")
-
-        viento  = procesar_viento(datos["dir_viento"], datos["int_viento"], datos["var_viento"])
-        vis_m   = convertir_visibilidad(datos["vis"])
-        vis_min_codigo = ""
-        if datos["vis_min"]:
-            vis_min_codigo, err = procesar_visibilidad_minima(datos["vis_min"], vis_m)
-            if err:
-                raise ValueError(err)
-        rvr_codigo = procesar_rvr(datos["rvr"])
-        fenomeno   = " ".join(datos["fenomenos"][:3]) if datos["fenomenos"] else ""
-        nubes      = interpretar_nubes_lista(datos["nubes"], vis_m, fenomeno)
-
-        temp  = float(datos["temp"])
-        rocio = float(datos["rocio"])
-        qnh   = float(datos["qnh"])
-        if rocio > temp:
-            raise ValueError(f"Rocío ({rocio}°C) no puede ser > Temperatura ({temp}°C)")
-        if not (-10 <= temp <= 40):
-            raise ValueError("Temperatura fuera de rango (-10 a 40°C)")
-        if not (850 <= qnh <= 1100):
-            raise ValueError("QNH fuera de rango (850-1100 hPa)")
-
-        es_valida, err_sup = validar_info_suplementaria(hora, datos["suplementaria"])
-        if not es_valida:
-            raise ValueError(err_sup)
-
-        t_m = redondear_metar(temp)
-        r_m = redondear_metar(rocio)
-        q_m = int(qnh)
-
-        partes = [f"{datos['tipo']} SPJC {datos['dia']}{hora}Z {viento}"]
-        if nubes == "CAVOK":
-            partes.append("CAVOK")
+            salida.append(ValueError("QNH fuera de rango (850-1100 hPa)"))
+    return salida
+
+def generar_lote(observaciones, mes=None, guardar=True, estacion=ESTACION):
+    """Valida y codifica muchas observaciones de `estacion` con las reglas de
+    generar_metar().
+
+    Devuelve un resultado por elemento, en el mismo orden. Las aceptadas se
+    guardan en el almacén en una sola transacción y el Excel se regenera
+    una sola vez.
+    """
+    mes = mes or obtener_mes()
+    resultados = [None] * len(observaciones)
+    validas = []
+    for i, obs in enumerate(observaciones):
+        try:
+            validas.append((i, normalizar_observacion(obs, mes)))
+        except ValueError as e:
+            resultados[i] = {"indice": i, "success": False, "error": str(e)}
+
+    numericos = validar_temp_qnh_lote([d for _, d in validas]) if validas else []
+    aceptados = []
+    for (i, datos), num in zip(validas, numericos):
+        res = generar_metar(datos, numericos=num, estacion=estacion)
+        if res["success"]:
+            aceptados.append((i, res))
+            resultados[i] = {"indice": i, "success": True, "metar": res["metar"]}
         else:
-            partes.append(f"{vis_m:04d}")
-            if vis_min_codigo: partes.append(vis_min_codigo)
-            if rvr_codigo:     partes.append(rvr_codigo)
-            if fenomeno:       partes.append(fenomeno)
-            partes.append(nubes)
-        partes.append(f"{t_m:02d}/{r_m:02d} Q{q_m}")
-        sup = datos["suplementaria"].strip().upper() if datos["suplementaria"] else ""
-        if sup:
-            partes.append(sup)
-        metar = " ".join(partes) + "="
-
-        registro = {
-            "Día": str(datos["dia"]).zfill(2),
-            "Hora": hora,
-            "Tipo": datos["tipo"],
-            "Dirección_Viento":    datos["dir_viento"],
-            "Intensidad_Viento":   datos["int_viento"],
-            "Variación_Viento":    datos["var_viento"],
-            "Visibilidad_Original":datos["vis"],
-            "Visibilidad_Metros":  vis_m,
-            "Visibilidad_Mínima":  vis_min_codigo,
-            "RVR":                 rvr_codigo,
-            "Fenómeno_Texto":      fenomeno,
-            "Fenómeno_Código":     fenomeno,
-            "Nubes_Texto":         str(datos["nubes"]),
-            "Nubes_Código":        nubes,
-            "Temperatura":         temp,
-            "Punto_Rocío":         rocio,
-            "Humedad_Relativa_%":  datos.get("hr", ""),
-            "QNH":                 qnh,
-            "Presión_Estación":    datos.get("presion", ""),
-            "Info_Suplementaria":  datos.get("suplementaria", ""),
-            "METAR_Completo":      metar,
-        }
-        return {"success": True, "metar": metar, "registro": registro}
-    except Exception as e:
-        return {"success": False, "error": str(e)}
+            resultados[i] = {"indice": i, "success": False, "error": res["error"]}
 
-def actualizar_o_insertar(registros, nuevo):
-    clave = f"{str(nuevo['Día']).zfill(2)}_{str(nuevo['Hora']).zfill(4)}"
-    for i, r in enumerate(registros):
-        if f"{str(r.get('Día','')).zfill(2)}_{str(r.get('Hora','')).zfill(4)}" == clave:
-            registros[i] = nuevo
-            return "actualizado"
-    registros.insert(0, nuevo)
-    return "insertado"
+    if guardar and aceptados:
+        aero = aerodromo(estacion)
+        acciones = aero.almacen.actualizar_o_insertar_lote(
+            mes, [res["registro"] for _, res in aceptados])
+        banderas = banderas_mes(aero, mes)
+        # Solo se difunden las observaciones de las últimas 24 h: un relleno
+        # de meses pasados desbordaría las colas de las pantallas
+        desde = time.time() - 24 * 3600
+        for (i, res), accion in zip(aceptados, acciones):
+            r = res["registro"]
+            resultados[i]["accion"]  = accion
+            resultados[i]["calidad"] = banderas.get(r.clave, [])
+            if (instante_observacion(mes, r.dia, r.hora) or 0) >= desde:
+                aero.anunciar(mes, r, accion)
+        aero.escritor.marcar(mes)
+    return resultados
 
 
 # ─────────────────────────────────────────────
 # RUTAS
 # ─────────────────────────────────────────────
+def estacion_pedida(codigo=None):
+    """Estación de la petición: `codigo`, ?estacion= o la elegida en la
+    sesión. None si no es una estación configurada."""
+    codigo = str(codigo or request.args.get("estacion") or session.get("estacion") or ESTACION)
+    return codigo.upper() if codigo.upper() in estaciones() else None
+
+def error_estacion():
+    return jsonify({"error": "Estación desconocida",
+                    "estaciones": sorted(estaciones())}), 400
+
 @app.route("/login", methods=["GET", "POST"])
 def login():
     error = None
@@ -411,12 +1193,15 @@ def login():
             session.clear()
             session["usuario"] = usuario
             sesion_init()
+            borradores.purgar()
             return redirect(url_for("index"))
         error = "Usuario o contraseña incorrectos"
-    return render_template("login.html", error=error)
+    return renderizar("login.html", error=error)
 
 @app.route("/logout")
 def logout():
+    if "borrador" in session:
+        borradores.descartar(session["borrador"])
     session.clear()
     return redirect(url_for("login"))
 
@@ -425,20 +1210,28 @@ def index():
     if "usuario" not in session:
         return redirect(url_for("login"))
     sesion_init()
-    return render_template("index.html",
+    aero = aerodromo(session["estacion"])
+    fenomenos, nubes = borradores.obtener(session["borrador"])
+    return renderizar("index.html",
         usuario          = session["usuario"],
-        historial        = session["historial"][:10],
-        contador         = len(session["registros"]),
+        estacion         = aero.codigo,
+        estaciones       = estaciones(),
+        historial        = aero.historial.instantanea(10)[1],
+        contador         = aero.almacen.contar(obtener_mes()),
         ultimo_metar     = session.get("ultimo_metar"),
         ultimo_tipo      = session.get("ultimo_tipo"),
-        fenomenos_lista  = session["fenomenos_lista"],
-        nubes_lista      = session["nubes_lista"],
+        fenomenos_lista  = fenomenos,
+        nubes_lista      = nubes,
         fenomenos_opciones = FENOMENOS_OPCIONES,
         tipos_nube       = TIPOS_NUBE,
         octas_labels     = OCTAS_LABELS,
         hoy              = datetime.now(timezone.utc).strftime("%d/%m/%Y"),
         dia_hoy          = datetime.now(timezone.utc).strftime("%d"),
-        archivo_mes      = obtener_nombre_archivo(),
+        archivo_mes      = obtener_nombre_archivo(estacion=aero.codigo),
+        persistencia     = aero.escritor.estado(),
+        ultimas_24h      = aero.almacen.recientes(24),
+        banderas_calidad = {dia + hora: control_calidad.texto(b)
+                            for (dia, hora), b in banderas_mes(aero, obtener_mes()).items()},
         mensaje          = session.pop("mensaje", None),
         tipo_mensaje     = session.pop("tipo_mensaje", None),
         form_data        = session.pop("form_data", {}),
@@ -454,6 +1247,7 @@ def generar():
     # Guardar datos del form para repoblar si hay error
     form_data = {k: v for k, v in request.form.items()}
     session["form_data"] = form_data
+    fenomenos, nubes = borradores.obtener(session["borrador"])
 
     datos = {
         "tipo":         request.form.get("tipo", "METAR"),
@@ -465,8 +1259,8 @@ def generar():
         "vis":          request.form.get("vis", "").strip(),
         "vis_min":      request.form.get("vis_min", "").strip(),
         "rvr":          request.form.get("rvr", "").strip(),
-        "fenomenos":    session["fenomenos_lista"],
-        "nubes":        session["nubes_lista"],
+        "fenomenos":    fenomenos,
+        "nubes":        nubes,
         "temp":         request.form.get("temp", "").strip(),
         "rocio":        request.form.get("rocio", "").strip(),
         "hr":           request.form.get("hr", "").strip(),
@@ -475,44 +1269,57 @@ def generar():
         "suplementaria":request.form.get("suplementaria", "").strip(),
     }
 
-    resultado = generar_metar(datos)
+    aero = aerodromo(session["estacion"])
+    with etapa("validacion"):
+        resultado = generar_metar(datos, estacion=aero.codigo)
 
     if resultado["success"]:
-        accion = actualizar_o_insertar(session["registros"], resultado["registro"])
-        guardar_registros_mes(session["registros"])
-
-        # Actualizar historial
-        metar     = resultado["metar"]
-        clave_new = f"{resultado['registro']['Día']}_{resultado['registro']['Hora']}"
-        hist      = [m for m in session["historial"]
-                     if not (lambda mo: mo and f"{mo.group(1)}_{mo.group(2)}" == clave_new)
-                        (re.search(r"SPJC (\d{2})(\d{4})Z", m))]
-        hist.insert(0, metar)
-        session["historial"]    = hist[:20]
-        session["ultimo_metar"] = metar
+        mes    = obtener_mes()
+        with etapa("almacen"):
+            accion = aero.almacen.actualizar_o_insertar(mes, resultado["registro"])
+            aero.escritor.marcar(mes)
+        with etapa("difusion"):
+            aero.anunciar(mes, resultado["registro"], accion)
+
+        session["ultimo_metar"] = resultado["metar"]
         session["ultimo_tipo"]  = datos["tipo"]
-        session["fenomenos_lista"] = []
-        session["nubes_lista"]     = []
+        borradores.descartar(session["borrador"])
         session["form_data"]       = {}
 
+        with etapa("calidad"):
+            avisos = banderas_mes(aero, mes).get(resultado["registro"].clave, [])
+
         msg = "METAR ACTUALIZADO" if accion == "actualizado" else "METAR generado correctamente"
+        if avisos:
+            msg += " — revisar: " + control_calidad.texto(avisos)
         session["mensaje"]      = msg
-        session["tipo_mensaje"] = "warning" if accion == "actualizado" else "success"
+        session["tipo_mensaje"] = "warning" if accion == "actualizado" or avisos else "success"
     else:
         session["error_metar"] = resultado["error"]
 
     session.modified = True
     return redirect(url_for("index"))
 
+@app.route("/estacion", methods=["POST"])
+def cambiar_estacion():
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    sesion_init()
+    codigo = estacion_pedida(request.form.get("estacion", "").strip())
+    if codigo:
+        session["estacion"] = codigo
+        session["form_data"] = {}
+    else:
+        session["mensaje"]      = "Estación desconocida"
+        session["tipo_mensaje"] = "error"
+    return redirect(url_for("index"))
+
 @app.route("/fenomeno/agregar", methods=["POST"])
 def agregar_fenomeno():
     if "usuario" not in session:
         return redirect(url_for("login"))
     sesion_init()
-    codigo = request.form.get("fenomeno_codigo", "").strip()
-    if codigo and codigo not in session["fenomenos_lista"] and len(session["fenomenos_lista"]) < 3:
-        session["fenomenos_lista"].append(codigo)
-        session.modified = True
+    editar_borrador(agregar_fenomeno_a(request.form.get("fenomeno_codigo", "").strip()))
     return redirect(url_for("index"))
 
 @app.route("/fenomeno/eliminar/<int:idx>", methods=["POST"])
@@ -520,9 +1327,7 @@ def eliminar_fenomeno(idx):
     if "usuario" not in session:
         return redirect(url_for("login"))
     sesion_init()
-    if 0 <= idx < len(session["fenomenos_lista"]):
-        session["fenomenos_lista"].pop(idx)
-        session.modified = True
+    editar_borrador(eliminar_de("fenomenos", idx))
     return redirect(url_for("index"))
 
 @app.route("/nube/agregar", methods=["POST"])
@@ -530,13 +1335,10 @@ def agregar_nube():
     if "usuario" not in session:
         return redirect(url_for("login"))
     sesion_init()
-    if len(session["nubes_lista"]) < 4:
-        session["nubes_lista"].append({
-            "octas":    int(request.form.get("octas", 1)),
-            "tipo":     request.form.get("tipo_nube", "SC"),
-            "altura_m": int(request.form.get("altura_m", 300)),
-        })
-        session.modified = True
+    try:
+        editar_borrador(agregar_nube_a(nube_desde(request.form)))
+    except ValueError as e:
+        session["error_metar"] = str(e)
     return redirect(url_for("index"))
 
 @app.route("/nube/eliminar/<int:idx>", methods=["POST"])
@@ -544,37 +1346,383 @@ def eliminar_nube(idx):
     if "usuario" not in session:
         return redirect(url_for("login"))
     sesion_init()
-    if 0 <= idx < len(session["nubes_lista"]):
-        session["nubes_lista"].pop(idx)
-        session.modified = True
+    editar_borrador(eliminar_de("nubes", idx))
     return redirect(url_for("index"))
 
+def cuerpo_json():
+    cuerpo = request.get_json(silent=True)
+    return cuerpo if isinstance(cuerpo, dict) else {}
+
+def respuesta_borrador(fenomenos, nubes, cuerpo):
+    """El borrador actualizado y, si el cliente mandó "formulario", la vista
+    previa del METAR."""
+    salida = {"fenomenos": fenomenos, "nubes": nubes}
+    if isinstance(cuerpo.get("formulario"), dict):
+        with etapa("vista_previa"):
+            salida["vista_previa"] = vista_previa(cuerpo["formulario"], fenomenos, nubes,
+                                                  session["estacion"])
+    return jsonify(salida)
+
+@app.route("/api/borrador", methods=["GET", "DELETE"])
+def api_borrador():
+    """Fenómenos y nubes del borrador (DELETE lo vacía)."""
+    if "usuario" not in session:
+        return jsonify({"error": "No autenticado"}), 401
+    sesion_init()
+    if request.method == "DELETE":
+        borradores.descartar(session["borrador"])
+    return respuesta_borrador(*borradores.obtener(session["borrador"]), {})
+
+@app.route("/api/borrador/vista_previa", methods=["POST"])
+def api_vista_previa():
+    """{"formulario": {...}} -> METAR que se generaría, sin guardarlo."""
+    if "usuario" not in session:
+        return jsonify({"error": "No autenticado"}), 401
+    sesion_init()
+    cuerpo = cuerpo_json()
+    if not isinstance(cuerpo.get("formulario"), dict):
+        return jsonify({"error": "Se espera {\"formulario\": {...}}"}), 400
+    return respuesta_borrador(*borradores.obtener(session["borrador"]), cuerpo)
+
+@app.route("/api/borrador/<lista>", methods=["POST"])
+def api_agregar_borrador(lista):
+    """{"codigo": "RA"} en fenomenos, {"octas", "tipo", "altura_m"} en nubes;
+    opcionalmente con "formulario" para la vista previa."""
+    if "usuario" not in session:
+        return jsonify({"error": "No autenticado"}), 401
+    sesion_init()
+    cuerpo = cuerpo_json()
+    if lista == "fenomenos":
+        cambio = agregar_fenomeno_a(str(cuerpo.get("codigo") or "").strip().upper())
+    elif lista == "nubes":
+        try:
+            cambio = agregar_nube_a(nube_desde(cuerpo))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Capa de nubes inválida"}), 400
+    else:
+        return jsonify({"error": "Lista desconocida"}), 404
+    return respuesta_borrador(*editar_borrador(cambio), cuerpo)
+
+@app.route("/api/borrador/<lista>/<int:idx>", methods=["DELETE"])
+def api_eliminar_borrador(lista, idx):
+    if "usuario" not in session:
+        return jsonify({"error": "No autenticado"}), 401
+    if lista not in ("fenomenos", "nubes"):
+        return jsonify({"error": "Lista desconocida"}), 404
+    sesion_init()
+    return respuesta_borrador(*editar_borrador(eliminar_de(lista, idx)),
+                              cuerpo_json())
+
+def etag_exportacion(estacion, mes, version):
+    return f"{estacion}-{mes}-v{version}"
+
 @app.route("/exportar")
 def exportar():
     if "usuario" not in session:
         return redirect(url_for("login"))
     sesion_init()
-    registros = session.get("registros", [])
-    if not registros:
+    aero = aerodromo(session["estacion"])
+    almacen, est, mes = aero.almacen, aero.codigo, obtener_mes()
+    if not almacen.contar(mes):
         session["mensaje"]      = "No hay registros para exportar"
         session["tipo_mensaje"] = "warning"
         return redirect(url_for("index"))
-    guardar_registros_mes(registros)
-    archivo = DIRECTORIO_DATOS / obtener_nombre_archivo()
-    if archivo.exists():
+
+    # El Excel del disco es la caché: solo se regenera si el mes cambió
+    version, _ = almacen.versiones(mes)
+    if request.if_none_match.contains(etag_exportacion(est, mes, version)):
+        return "", 304, {"ETag": f'"{etag_exportacion(est, mes, version)}"'}
+    with etapa("excel_vaciar"):
+        aero.escritor.vaciar(mes)
+    # Se sirve lo que vaciar() dejó escrito aunque otro guardado ya haya
+    # subido la versión del almacén; el ETag es el de ese Excel
+    _, version_excel = almacen.versiones(mes)
+    archivo = archivo_excel(mes, est)
+    if archivo.exists() and version_excel > 0:
         return send_file(str(archivo.resolve()),
                          as_attachment=True,
-                         download_name=obtener_nombre_archivo())
+                         download_name=obtener_nombre_archivo(mes, est),
+                         etag=etag_exportacion(est, mes, version_excel),
+                         conditional=True,
+                         max_age=0)
     session["mensaje"]      = "Error al generar el archivo"
     session["tipo_mensaje"] = "error"
     return redirect(url_for("index"))
 
+@app.route("/api/exportaciones", methods=["POST"])
+def api_exportar_rango():
+    """Pide un reporte de varios meses; responde con el id para consultar."""
+    if "usuario" not in session:
+        return jsonify({"error": "No autenticado"}), 401
+    cuerpo = request.get_json(silent=True)
+    if cuerpo is None:
+        cuerpo = request.form
+    if not isinstance(cuerpo, dict):
+        return jsonify({"error": "Se espera {\"desde\": \"AAAA_MM\", \"hasta\": \"AAAA_MM\"}"}), 400
+    est = estacion_pedida(cuerpo.get("estacion"))
+    if est is None:
+        return error_estacion()
+    aero = aerodromo(est)
+    desde, hasta = str(cuerpo.get("desde", "")), str(cuerpo.get("hasta", ""))
+    if not (re.fullmatch(r"\d{4}_\d{2}", desde) and re.fullmatch(r"\d{4}_\d{2}", hasta)):
+        return jsonify({"error": "desde y hasta deben ser AAAA_MM"}), 400
+    if desde > hasta or len(meses_entre(desde, hasta)) > MAX_MESES_REPORTE:
+        return jsonify({"error": f"Rango inválido (máximo {MAX_MESES_REPORTE} meses)"}), 400
+    fuentes = aero.almacen.fuentes_rango(desde, hasta)
+    if not fuentes:
+        return jsonify({"error": "No hay registros en ese rango"}), 404
+    id_trabajo = ColaExportaciones.id_trabajo(est, desde, hasta, fuentes)
+    estado = aero.exportaciones.enviar(id_trabajo, est, fuentes)
+    if estado is None:
+        return jsonify({"error": "Hay demasiadas exportaciones en curso; intenta en un momento"}), 429
+    estado["meses"] = [mes for mes, _, _ in fuentes]
+    estado["url"]   = url_for("api_estado_exportacion", id_trabajo=id_trabajo)
+    return jsonify(estado), 200 if estado["estado"] == "listo" else 202
+
+def exportaciones_de(id_trabajo):
+    """Cola de la estación del trabajo (el id empieza con su código), o None."""
+    if not RE_ID.match(id_trabajo) or id_trabajo[:4] not in estaciones():
+        return None
+    return aerodromo(id_trabajo[:4]).exportaciones
+
+@app.route("/api/exportaciones/<id_trabajo>")
+def api_estado_exportacion(id_trabajo):
+    if "usuario" not in session:
+        return jsonify({"error": "No autenticado"}), 401
+    cola = exportaciones_de(id_trabajo)
+    if cola is None:
+        return jsonify({"error": "Id inválido"}), 400
+    estado = cola.estado(id_trabajo)
+    if estado["estado"] == "desconocido":
+        return jsonify(estado), 404
+    if estado["estado"] == "listo":
+        estado["descarga"] = url_for("api_descargar_exportacion", id_trabajo=id_trabajo)
+    return jsonify(estado)
+
+@app.route("/api/exportaciones/<id_trabajo>/archivo")
+def api_descargar_exportacion(id_trabajo):
+    if "usuario" not in session:
+        return jsonify({"error": "No autenticado"}), 401
+    cola = exportaciones_de(id_trabajo)
+    archivo = cola.archivo(id_trabajo) if cola else None
+    if archivo is None:
+        return jsonify({"error": "El reporte no existe o aún no está listo"}), 404
+    estacion, d_anio, d_mes, h_anio, h_mes, _ = id_trabajo.split("_")
+    return send_file(str(archivo.resolve()), as_attachment=True,
+                     download_name=f"{estacion}_METAR_{d_anio}_{d_mes}_a_{h_anio}_{h_mes}.xlsx",
+                     conditional=True, max_age=0)
+
+def leer_instante(texto, fin=False):
+    """AAAA-MM-DD o AAAA-MM-DDTHH:MM (UTC). Una fecha sola como `fin`
+    cubre el día completo. Con zona (Z, +00:00, -05:00) se pasa a UTC."""
+    instante = datetime.fromisoformat(texto)
+    if instante.tzinfo is not None:
+        instante = instante.astimezone(timezone.utc).replace(tzinfo=None)
+    if fin and len(texto) == 10:
+        instante = instante.replace(hour=23, minute=59)
+    return instante
+
+def filas_rango(almacen, desde, hasta):
+    """Filas (orden COLUMNAS_EXCEL) entre dos instantes, mes por mes: en
+    memoria hay a lo sumo un lote del almacén o un mes leído de Excel."""
+    mes_desde, mes_hasta = desde.strftime("%Y_%m"), hasta.strftime("%Y_%m")
+    for mes, origen, _ in almacen.fuentes_rango(mes_desde, mes_hasta):
+        ini = (desde.strftime("%d"), desde.strftime("%H%M")) if mes == mes_desde else None
+        fin = (hasta.strftime("%d"), hasta.strftime("%H%M")) if mes == mes_hasta else None
+        if origen == "almacen":
+            registros = almacen.iterar(mes, ini, fin)
+        else:
+            # Sin pasar por _cache_meses: un rango largo no debe quedar en memoria
+            try:
+                with etapa("excel_leer"):
+                    leidos = _leer_excel_mes(Path(origen), almacen.estacion)
+            except Exception:
+                leidos = []
+            registros = (r for r in leidos
+                         if (ini is None or r.clave >= ini) and (fin is None or r.clave <= fin))
+        for r in registros:
+            yield r.a_fila_excel()
+
+def texto_csv(filas, cada=500):
+    buffer = io.StringIO()
+    escritor_csv = csv.writer(buffer)
+    escritor_csv.writerow(COLUMNAS_EXCEL)
+    yield buffer.getvalue()                 # el encabezado sale de inmediato
+    buffer.seek(0)
+    buffer.truncate()
+    for i, fila in enumerate(filas, start=1):
+        escritor_csv.writerow(fila)
+        if i % cada == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def texto_ndjson(filas, cada=500):
+    lineas = []
+    for fila in filas:
+        lineas.append(json.dumps(dict(zip(COLUMNAS_EXCEL, fila)), ensure_ascii=False))
+        if len(lineas) >= cada:
+            yield "\n".join(lineas) + "\n"
+            lineas = []
+    if lineas:
+        yield "\n".join(lineas) + "\n"
+
+@app.route("/api/registros")
+def api_registros():
+    """Observaciones de un rango de fechas en CSV o NDJSON, en streaming."""
+    if "usuario" not in session:
+        return jsonify({"error": "No autenticado"}), 401
+    est = estacion_pedida()
+    if est is None:
+        return error_estacion()
+    formato = request.args.get("formato", "ndjson")
+    if formato not in ("csv", "ndjson"):
+        return jsonify({"error": "formato debe ser csv o ndjson"}), 400
+    try:
+        desde = leer_instante(request.args["desde"])
+        hasta = (leer_instante(request.args["hasta"], fin=True) if request.args.get("hasta")
+                 else datetime.now(timezone.utc).replace(tzinfo=None))
+    except (KeyError, ValueError):
+        return jsonify({"error": "desde (y hasta) deben ser AAAA-MM-DD o AAAA-MM-DDTHH:MM"}), 400
+    if desde > hasta:
+        return jsonify({"error": "desde es posterior a hasta"}), 400
+
+    filas = filas_rango(aerodromo(est).almacen, desde, hasta)
+    nombre = f"{est}_METAR_{desde:%Y%m%d}_{hasta:%Y%m%d}.{formato}"
+    if formato == "csv":
+        cuerpo, tipo = texto_csv(filas), "text/csv"
+    else:
+        cuerpo, tipo = texto_ndjson(filas), "application/x-ndjson"
+    return Response(cuerpo, mimetype=tipo,
+                    headers={"Content-Disposition": f'attachment; filename="{nombre}"'})
+
+@app.route("/api/generar_lote", methods=["POST"])
+def api_generar_lote():
+    if "usuario" not in session:
+        return jsonify({"error": "No autenticado"}), 401
+    cuerpo = request.get_json(silent=True)
+    if isinstance(cuerpo, list):
+        cuerpo = {"observaciones": cuerpo}
+    if not isinstance(cuerpo, dict) or not isinstance(cuerpo.get("observaciones"), list):
+        return jsonify({"error": "Se espera {\"observaciones\": [...]}"}), 400
+    est = estacion_pedida(cuerpo.get("estacion"))
+    if est is None:
+        return error_estacion()
+    mes = cuerpo.get("mes") or obtener_mes()
+    if not mes_valido(mes):
+        return jsonify({"error": "mes debe ser AAAA_MM (mes 01 a 12)"}), 400
+
+    resultados = generar_lote(cuerpo["observaciones"], mes, estacion=est)
+    aceptados  = sum(1 for r in resultados if r["success"])
+    return jsonify({
+        "estacion":   est,
+        "mes":        mes,
+        "aceptados":  aceptados,
+        "rechazados": len(resultados) - aceptados,
+        "resultados": resultados,
+    })
+
+@app.route("/api/historial")
+def api_historial():
+    if "usuario" not in session:
+        return jsonify({"error": "No autenticado"}), 401
+    est = estacion_pedida()
+    if est is None:
+        return error_estacion()
+    etag, textos = aerodromo(est).historial.instantanea()
+    if request.if_none_match.contains(etag):
+        return "", 304, {"ETag": f'"{etag}"'}
+    respuesta = jsonify({"historial": textos})
+    respuesta.set_etag(etag)
+    respuesta.cache_control.no_cache = True
+    return respuesta
+
+@app.route("/api/estadisticas")
+def api_estadisticas():
+    if "usuario" not in session:
+        return jsonify({"error": "No autenticado"}), 401
+    est = estacion_pedida()
+    if est is None:
+        return error_estacion()
+    mes = request.args.get("mes") or obtener_mes()
+    if not re.fullmatch(r"\d{4}_\d{2}", mes):
+        return jsonify({"error": "mes debe ser AAAA_MM"}), 400
+    version, registros = aerodromo(est).almacen.con_version(mes)
+    return jsonify(estadisticas.obtener(est, mes, version, registros))
+
+@app.route("/api/calidad")
+def api_calidad():
+    """Observaciones del mes marcadas por el control de calidad."""
+    if "usuario" not in session:
+        return jsonify({"error": "No autenticado"}), 401
+    est = estacion_pedida()
+    if est is None:
+        return error_estacion()
+    mes = request.args.get("mes") or obtener_mes()
+    if not re.fullmatch(r"\d{4}_\d{2}", mes):
+        return jsonify({"error": "mes debe ser AAAA_MM"}), 400
+    version, registros = aerodromo(est).almacen.con_version(mes)
+    banderas = calidad.obtener(est, mes, version, registros)
+    return jsonify({
+        "estacion": est,
+        "mes":      mes,
+        "version":  version,
+        "total":    len(registros),
+        "marcados": [{"dia": dia, "hora": hora, "tipo": registros.obtener(dia, hora).tipo,
+                      "metar": registros.obtener(dia, hora).metar, "banderas": b}
+                     for (dia, hora), b in sorted(banderas.items())
+                     if registros.obtener(dia, hora) is not None],
+    })
+
+@app.route("/api/feed")
+def api_feed():
+    """Boletines nuevos como Server-Sent Events (text/event-stream)."""
+    if "usuario" not in session:
+        return jsonify({"error": "No autenticado"}), 401
+    est = estacion_pedida()
+    if est is None:
+        return error_estacion()
+    difusor = aerodromo(est).difusor
+    ultimo = request.headers.get("Last-Event-ID") or request.args.get("desde")
+    try:
+        ultimo = int(ultimo) if ultimo else None
+    except ValueError:
+        ultimo = 0                      # id ilegible: el cliente recibe "reinicio"
+
+    # Suscrito antes de responder, para no perder lo publicado mientras tanto
+    suscripcion = difusor.suscribir(ultimo)
+
+    def eventos():
+        yield "retry: 3000\n\n"
+        for evento in difusor.escuchar(suscripcion):
+            yield evento.sse() if evento else ": ping\n\n"
+
+    respuesta = Response(eventos(), mimetype="text/event-stream",
+                         headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    respuesta.call_on_close(lambda: difusor.cancelar(suscripcion))
+    return respuesta
+
+@app.route("/metrics")
+def metrics():
+    """Métricas de este proceso para Prometheus."""
+    return Response(exponer(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/estado_persistencia")
+def estado_persistencia():
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    return jsonify(aerodromo(estacion_pedida() or ESTACION).escritor.estado())
+
 @app.route("/limpiar_memoria", methods=["POST"])
 def limpiar_memoria():
     if "usuario" not in session:
         return redirect(url_for("login"))
-    session["registros"] = []
-    session["historial"] = []
+    sesion_init()
+    aero = aerodromo(session["estacion"])
+    aero.almacen.limpiar(obtener_mes())
+    aero.escritor.marcar(obtener_mes())
+    aero.historial.limpiar()
     session["mensaje"]      = "Memoria limpiada"
     session["tipo_mensaje"] = "success"
     session.modified = True
@@ -584,5 +1732,17 @@ def limpiar_memoria():
 # ─────────────────────────────────────────────
 # ARRANQUE
 # ─────────────────────────────────────────────
+def precalentar():
+    """Carga por adelantado lo que si no cargaría la primera petición que
+    lo necesite: pandas, openpyxl, y la base y el mes en curso de cada estación."""
+    for modulo in ("pandas", "exportador_excel"):
+        importlib.import_module(modulo)
+    for codigo in estaciones():
+        aerodromo(codigo).almacen.contar(obtener_mes())
+
+# Con METAR_PRECALENTAR=1 cada worker se precalienta en segundo plano al arrancar
+if os.environ.get("METAR_PRECALENTAR"):
+    threading.Thread(target=precalentar, name="precalentar", daemon=True).start()
+
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
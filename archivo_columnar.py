@@ -0,0 +1,181 @@
+"""
+Archivo histórico en columnas, junto a los Excel mensuales.
+
+Cada mes es un arreglo estructurado de NumPy (archivo/<estación>/AAAA_MM.npy)
+que se reescribe cada vez que se guarda el Excel de ese mes. Las consultas
+abren las particiones del rango pedido con memmap y filtran por columnas,
+sin leer ningún libro de Excel:
+
+    consultar(raiz, desde=date(2022, 1, 1), tipo="SPECI", vis_lt=1500)
+
+    python archivo_columnar.py --reconstruir    # desde los Excel existentes
+"""
+
+from datetime import date, datetime
+from pathlib import Path
+import argparse
+import os
+import re
+
+import numpy as np
+
+COLUMNAS = np.dtype([
+    ("fecha",   "datetime64[m]"),
+    ("tipo",    "S5"),
+    ("dir",     "i2"),     # -1: VRB o desconocida
+    ("viento",  "i2"),
+    ("racha",   "i2"),     # -1: sin ráfaga
+    ("vis",     "i4"),
+    ("vis_min", "i4"),     # -1: sin visibilidad mínima
+    ("techo",   "i4"),     # pies; -1: sin BKN/OVC/VV
+    ("temp",    "f4"),
+    ("rocio",   "f4"),
+    ("qnh",     "f4"),
+    ("wx",      "S32"),
+    ("nubes",   "S48"),
+    ("metar",   "S200"),
+])
+
+OPERADORES = {"lt": np.less, "le": np.less_equal, "gt": np.greater,
+              "ge": np.greater_equal, "eq": np.equal}
+
+RE_TECHO  = re.compile(r"(?:BKN|OVC|VV)(\d{3})")
+RE_VIENTO = re.compile(r"\b(\d{3}|VRB)\d{2,3}(?:G\d{2,3})?KT\b")
+
+
+def _entero(valor, defecto=-1):
+    try:
+        return int(float(valor))
+    except (TypeError, ValueError):
+        return defecto
+
+
+def _real(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def techo_pies(nubes_codigo):
+    """Altura de la capa BKN/OVC/VV más baja, en pies; -1 si no hay."""
+    alturas = [int(h) * 100 for h in RE_TECHO.findall(str(nubes_codigo))]
+    return min(alturas) if alturas else -1
+
+
+def direccion(r):
+    """Dirección del viento en grados; -1 si es variable (VRB).
+
+    Sale del grupo de viento del boletín: dir_viento guarda lo que se
+    escribió en el formulario (o 000 si se importó un VRB), aunque el METAR
+    diga VRB."""
+    m = RE_VIENTO.search(str(r.metar))
+    if m:
+        return -1 if m.group(1) == "VRB" else int(m.group(1))
+    return _entero(r.dir_viento) if str(r.dir_viento).upper() != "VRB" else -1
+
+
+def _fila(anio, mes, r):
+    viento, _, racha = str(r.int_viento).upper().partition("G")
+    return (
+        np.datetime64(f"{anio:04d}-{mes:02d}-{r.dia}T{r.hora[:2]}:{r.hora[2:]}", "m"),
+        str(r.tipo).encode(),
+        direccion(r),
+        _entero(viento, 0),
+        _entero(racha),
+        _entero(r.vis_metros, 9999),
+        _entero(str(r.vis_minima)[:4]),
+        techo_pies(r.nubes_codigo),
+        _real(r.temperatura),
+        _real(r.rocio),
+        _real(r.qnh),
+        str(r.fenomeno_codigo).encode()[:32],
+        str(r.nubes_codigo).encode()[:48],
+        str(r.metar).encode()[:200],
+    )
+
+
+def ruta_particion(raiz, estacion, mes):
+    return Path(raiz) / estacion / f"{mes}.npy"
+
+
+def a_columnas(mes, registros):
+    """Arreglo estructurado (COLUMNAS) con los registros del mes AAAA_MM."""
+    anio, num = map(int, mes.split("_"))
+    filas = []
+    for r in registros:
+        try:
+            filas.append(_fila(anio, num, r))
+        except ValueError:
+            continue           # día/hora imposibles para ese mes
+    return np.array(filas, dtype=COLUMNAS)
+
+
+def escribir_mes(raiz, estacion, mes, registros):
+    """Reescribe la partición del mes (AAAA_MM) con los registros dados."""
+    datos = a_columnas(mes, registros)
+    destino = ruta_particion(raiz, estacion, mes)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    temporal = destino.with_suffix(f".{os.getpid()}.tmp")
+    with open(temporal, "wb") as f:
+        np.save(f, datos)
+    os.replace(temporal, destino)
+
+
+def _mes(valor):
+    return valor.strftime("%Y_%m") if valor is not None else None
+
+
+def consultar(raiz, desde=None, hasta=None, tipo=None, estacion="SPJC", **umbrales):
+    """Observaciones entre `desde` y `hasta` (date/datetime, ambos incluidos).
+
+    `umbrales` usa la forma columna_operador, p. ej. vis_lt=1500, techo_le=500,
+    qnh_ge=1020. Devuelve un arreglo estructurado con las columnas COLUMNAS.
+    """
+    filtros = []
+    for clave, valor in umbrales.items():
+        columna, _, op = clave.rpartition("_")
+        if columna not in COLUMNAS.names or op not in OPERADORES:
+            raise ValueError(f"Filtro desconocido: {clave}")
+        filtros.append((columna, OPERADORES[op], valor))
+    if isinstance(desde, date) and not isinstance(desde, datetime):
+        desde = datetime(desde.year, desde.month, desde.day)
+    if isinstance(hasta, date) and not isinstance(hasta, datetime):
+        hasta = datetime(hasta.year, hasta.month, hasta.day, 23, 59)
+
+    partes = []
+    for archivo in sorted((Path(raiz) / estacion).glob("*.npy")):
+        mes = archivo.stem
+        if (desde and mes < _mes(desde)) or (hasta and mes > _mes(hasta)):
+            continue
+        datos = np.load(archivo, mmap_mode="r")
+        mascara = np.ones(len(datos), dtype=bool)
+        if desde:
+            mascara &= datos["fecha"] >= np.datetime64(desde, "m")
+        if hasta:
+            mascara &= datos["fecha"] <= np.datetime64(hasta, "m")
+        if tipo:
+            mascara &= datos["tipo"] == tipo.encode()
+        for columna, operador, valor in filtros:
+            mascara &= operador(datos[columna], valor)
+        partes.append(np.array(datos[mascara]))
+        del datos
+    return np.concatenate(partes) if partes else np.empty(0, dtype=COLUMNAS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archivo columnar de observaciones")
+    parser.add_argument("--reconstruir", action="store_true",
+                        help="Crea las particiones desde todos los Excel mensuales")
+    args = parser.parse_args(argv)
+    if args.reconstruir:
+        import app
+        for estacion in app.estaciones():
+            for mes in app.meses_excel(estacion):
+                registros = app.cargar_registros_mes(mes, estacion)
+                escribir_mes(app.ARCHIVO_COLUMNAR, estacion, mes, registros)
+                print(f"{estacion} {mes}: {len(registros)} registros")
+
+
+if __name__ == "__main__":
+    main()
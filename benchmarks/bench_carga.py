@@ -0,0 +1,66 @@
+"""
+Tiempo de carga del Excel mensual: lector anterior (iterrows) frente a
+cargar_registros_mes() por columnas, en frío y con caché.
+
+    python benchmarks/bench_carga.py [filas ...]
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sinteticos import registros
+
+import app
+import pandas as pd
+
+
+def cargar_con_iterrows(archivo):
+    """Lector de la versión anterior, conservado solo para comparar."""
+    df = pd.read_excel(archivo, sheet_name="METAR SPJC")
+    salida = []
+    for _, row in df.iterrows():
+        r = row.to_dict()
+        r["Día"]            = str(r.get("DIA",  "")).zfill(2)
+        r["Hora"]           = str(r.get("HORA", "")).zfill(4)
+        r["Tipo"]           = r.get("TIPO", "")
+        r["METAR_Completo"] = r.get("METAR", "")
+        salida.append(r)
+    return salida
+
+
+def medir(funcion, repeticiones=3):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor
+
+
+def main(tamanos):
+    print(f"{'filas':>7} {'iterrows':>10} {'columnas':>10} {'caché':>10}")
+    for n in tamanos:
+        with tempfile.TemporaryDirectory() as tmp:
+            app.DIRECTORIO_DATOS = Path(tmp)
+            mes = "2025_01"
+            # Con más de 1 488 filas se acorta el paso para que las claves
+            # (día, hora) no se repitan: el mes guarda una fila por clave
+            paso = min(30, 31 * 24 * 60 // n)
+            app.guardar_registros_mes(registros(n, paso_min=paso), mes)
+            archivo = app.archivo_excel(mes)
+            assert len(app.cargar_registros_mes(mes)) == n, "claves repetidas"
+
+            antes = medir(lambda: cargar_con_iterrows(archivo))
+
+            def en_frio():
+                app._cache_meses.clear()
+                app.cargar_registros_mes(mes)
+            despues = medir(en_frio)
+            cacheado = medir(lambda: app.cargar_registros_mes(mes), repeticiones=10)
+        print(f"{n:>7} {antes*1000:>8.0f}ms {despues*1000:>8.0f}ms {cacheado*1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [1500, 15000])
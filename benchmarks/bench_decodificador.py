@@ -0,0 +1,69 @@
+"""
+Ida y vuelta del decodificador y su velocidad.
+
+Codifica formularios sintéticos con generar_metar(), los decodifica y
+comprueba que el registro decodificado vuelve a dar exactamente el mismo
+boletín y los mismos códigos. Después mide líneas por segundo sobre un
+archivo de prueba con uno y con varios procesos.
+
+    python benchmarks/bench_decodificador.py [líneas]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from sinteticos import formularios
+
+from codificador import generar_metar
+from decodificador import a_formulario, decodificar_archivo, decodificar_metar
+
+CAMPOS_COMPARADOS = ("dia", "hora", "tipo", "vis_metros", "vis_minima", "rvr",
+                     "fenomeno_codigo", "nubes_codigo", "qnh")
+
+
+def ida_y_vuelta(n):
+    fallos = 0
+    extra = [dict(vis_min="1200SW", vis="4000"), dict(rvr="R15/0600"),
+             dict(var_viento="100V300", int_viento="02"), dict(temp="-2.6", rocio="-4")]
+    datos = list(formularios(n))
+    for i, cambio in enumerate(extra):
+        datos[i].update(cambio)
+    for d in datos:
+        original = generar_metar(d)
+        if not original["success"]:
+            continue
+        decodificado = decodificar_metar(original["metar"])
+        vuelta = generar_metar(a_formulario(decodificado))
+        distintos = [c for c in CAMPOS_COMPARADOS
+                     if getattr(decodificado, c) != getattr(original["registro"], c)]
+        if not vuelta["success"] or vuelta["metar"] != original["metar"] or distintos:
+            fallos += 1
+            if fallos <= 5:
+                print("FALLO", original["metar"], "->", vuelta.get("metar") or vuelta["error"], distintos)
+    return len(datos), fallos
+
+
+def velocidad(n):
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8") as f:
+        metars = [generar_metar(d)["metar"] for d in formularios(1488)]
+        for i in range(n):
+            f.write(f"202501{i // 48 % 28 + 1:02d}0000 {metars[i % len(metars)]}\n")
+        ruta = f.name
+    try:
+        for procesos in sorted({1, os.cpu_count() or 1}):
+            t0 = time.perf_counter()
+            total = sum(1 for _ in decodificar_archivo(ruta, procesos=procesos))
+            dt = time.perf_counter() - t0
+            print(f"{procesos:>2} proceso(s): {total} líneas en {dt:.2f} s — {total / dt:,.0f} líneas/s")
+    finally:
+        os.unlink(ruta)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    total, fallos = ida_y_vuelta(3000)
+    print(f"ida y vuelta: {total - fallos}/{total} boletines idénticos")
+    velocidad(n)
+    sys.exit(1 if fallos else 0)
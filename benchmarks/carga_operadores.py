@@ -0,0 +1,258 @@
+"""
+Prueba de carga: operadores y pantallas usando la aplicación a la vez, sin
+red (cliente de pruebas de Flask, un hilo por usuario, como un servidor de
+hilos).
+
+Cada operador inicia sesión en su estación y, por cada boletín, arma el
+borrador (fenómenos y nubes, con vista previa), envía /generar y vuelve a
+la página principal. Emite un METAR cada `--cadencia` segundos y, con
+probabilidad `--rafagas`, una ráfaga de SPECI seguidos; cada `--exportar`
+segundos descarga el Excel del mes. Los visores consultan /api/historial
+(con ETag) y, de vez en cuando, /api/estadisticas.
+
+Al final informa por ruta peticiones por segundo, p50/p95/p99 y errores, y
+comprueba que el Excel de cada estación en disco coincide con el almacén y
+que no se perdió ninguna observación aceptada.
+
+    python benchmarks/carga_operadores.py --operadores 8 --visores 20 --duracion 30
+    python benchmarks/carga_operadores.py --estaciones SPJC,SPQU --cadencia 0.5
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from collections import defaultdict
+
+from sinteticos import formularios
+
+USUARIO = {"usuario": "admin", "password": "corpac2024"}
+
+
+class Mediciones:
+    """(ruta -> duraciones) y (ruta -> errores), compartidas por los hilos."""
+
+    def __init__(self):
+        self.duraciones = defaultdict(list)
+        self.errores    = defaultdict(int)
+        self._lock      = threading.Lock()
+
+    def pedir(self, nombre, funcion, *args, esperados=(200,), **kwargs):
+        t0 = time.perf_counter()
+        try:
+            r = funcion(*args, **kwargs)
+            ok = r.status_code in esperados
+        except Exception:
+            r, ok = None, False
+        duracion = time.perf_counter() - t0
+        with self._lock:
+            self.duraciones[nombre].append(duracion)
+            if not ok:
+                self.errores[nombre] += 1
+        return r
+
+
+def percentil(ordenadas, q):
+    return ordenadas[min(len(ordenadas) - 1, int(q * len(ordenadas)))]
+
+
+def _plantillas_minimas(app):
+    """Sin templates/ (p. ej. en una copia solo con el código) se usan unas
+    mínimas: se mide el trabajo del servidor, no el HTML."""
+    import jinja2
+    try:
+        app.app.jinja_env.get_template("index.html")
+    except jinja2.TemplateNotFound:
+        app.app.jinja_loader = jinja2.DictLoader({
+            "login.html": "{{ error }}",
+            "index.html": "{{ contador }} {{ ultimo_metar }} {{ historial|length }}",
+        })
+        print("(sin templates/: se usan plantillas mínimas)", file=sys.stderr)
+
+
+def operador(app, med, fin, args, estacion, k, aceptados):
+    rnd = random.Random(k)
+    cliente = app.app.test_client()
+    med.pedir("POST /login", cliente.post, "/login", data=USUARIO, esperados=(302,))
+    med.pedir("POST /estacion", cliente.post, "/estacion", data={"estacion": estacion},
+              esperados=(302,))
+    ultima_exportacion = time.monotonic()
+    # Cada operador recorre el mes desde su propio punto de partida
+    datos = formularios(100_000, semilla=1000 + k)
+    for _ in range(rnd.randrange(0, 1488)):
+        next(datos)
+
+    def boletin(form):
+        formulario = {c: v for c, v in form.items() if c not in ("fenomenos", "nubes")}
+        med.pedir("DELETE /api/borrador", cliente.delete, "/api/borrador")
+        for codigo in form["fenomenos"]:
+            med.pedir("POST /api/borrador/fenomenos", cliente.post, "/api/borrador/fenomenos",
+                      json={"codigo": codigo, "formulario": formulario})
+        for capa in form["nubes"]:
+            med.pedir("POST /api/borrador/nubes", cliente.post, "/api/borrador/nubes",
+                      json=dict(capa, formulario=formulario))
+        if form["nubes"] and rnd.random() < 0.2:      # el operador corrige una capa
+            med.pedir("DELETE /api/borrador/nubes", cliente.delete, "/api/borrador/nubes/0",
+                      json={"formulario": formulario})
+            med.pedir("POST /api/borrador/nubes", cliente.post, "/api/borrador/nubes",
+                      json=dict(form["nubes"][0], formulario=formulario))
+        r = med.pedir("POST /generar", cliente.post, "/generar", data=formulario,
+                      esperados=(302,))
+        if r is not None and r.status_code == 302:
+            aceptados.add((estacion, form["dia"], form["hora"]))
+        med.pedir("GET /", cliente.get, "/")
+
+    while not fin.is_set():
+        inicio = time.monotonic()
+        form = next(datos)
+        boletin(form)
+        if rnd.random() < args.rafagas:
+            # Ráfaga de SPECI en la misma media hora: condiciones que cambian rápido
+            for minuto in range(5, 5 + 5 * rnd.randint(2, 5), 5):
+                hora = f"{form['hora'][:2]}{int(form['hora'][2:]) + minuto:02d}"
+                boletin(dict(form, tipo="SPECI", hora=hora, suplementaria="PP000",
+                             vis=rnd.choice(["3000", "1500", "0800"]),
+                             fenomenos=[rnd.choice(["-RA", "BR", "FG", "TS"])]))
+                if fin.wait(args.cadencia / 10):
+                    break
+        if time.monotonic() - ultima_exportacion > args.exportar:
+            med.pedir("GET /exportar", cliente.get, "/exportar", esperados=(200, 304))
+            ultima_exportacion = time.monotonic()
+        fin.wait(max(0.0, args.cadencia - (time.monotonic() - inicio)))
+
+
+def visor(app, med, fin, args, estacion, k):
+    cliente = app.app.test_client()
+    med.pedir("POST /login", cliente.post, "/login", data=USUARIO, esperados=(302,))
+    etag, vuelta = None, 0
+    while not fin.is_set():
+        cabeceras = {"If-None-Match": etag} if etag else {}
+        r = med.pedir("GET /api/historial", cliente.get, f"/api/historial?estacion={estacion}",
+                      headers=cabeceras, esperados=(200, 304))
+        if r is not None and r.status_code == 200:
+            etag = r.headers.get("ETag")
+        vuelta += 1
+        if vuelta % 10 == k % 10:
+            med.pedir("GET /api/estadisticas", cliente.get,
+                      f"/api/estadisticas?estacion={estacion}")
+        fin.wait(args.sondeo)
+
+
+def comprobar(app, aceptados):
+    """Problemas de consistencia entre el almacén y los Excel en disco."""
+    fallos = []
+    mes = app.obtener_mes()
+    for codigo in sorted({e for e, _, _ in aceptados}):
+        aero = app.aerodromo(codigo)
+        aero.escritor.vaciar()
+        almacen = list(aero.almacen.registros(mes))
+        claves = {(r.dia, r.hora) for r in almacen}
+        perdidas = {(d, h) for e, d, h in aceptados if e == codigo} - claves
+        if perdidas:
+            fallos.append(f"{codigo}: {len(perdidas)} observaciones aceptadas no están en el almacén")
+        archivo = app.archivo_excel(mes, codigo)
+        try:
+            with zipfile.ZipFile(archivo) as z:
+                if z.testzip() is not None:
+                    raise zipfile.BadZipFile
+        except (OSError, zipfile.BadZipFile):
+            fallos.append(f"{codigo}: {archivo.name} no existe o está dañado")
+            continue
+        app._cache_meses.clear()
+        excel = app.cargar_registros_mes(mes, codigo)
+        if [r.metar for r in excel] != [r.metar for r in almacen]:
+            fallos.append(f"{codigo}: el Excel ({len(excel)} filas) no coincide con el "
+                          f"almacén ({len(almacen)})")
+        if aero.almacen.meses_pendientes():
+            fallos.append(f"{codigo}: quedaron cambios sin escribir en el Excel")
+        print(f"{codigo}: {len(almacen)} observaciones en {mes}, Excel {archivo.stat().st_size:,} bytes")
+    return fallos
+
+
+def informe(med, duracion):
+    total = errores = 0
+    print(f"\n{'ruta':<32}{'n':>7}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'errores':>9}")
+    for nombre in sorted(med.duraciones):
+        ms = sorted(d * 1000 for d in med.duraciones[nombre])
+        n, e = len(ms), med.errores[nombre]
+        total, errores = total + n, errores + e
+        print(f"{nombre:<32}{n:>7}{n / duracion:>8.1f}{percentil(ms, 0.50):>9.1f}"
+              f"{percentil(ms, 0.95):>9.1f}{percentil(ms, 0.99):>9.1f}{e:>9}")
+    print(f"{'total':<32}{total:>7}{total / duracion:>8.1f}{'':>27}{errores:>9}  (ms)")
+    return errores / total if total else 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga con operadores simulados")
+    parser.add_argument("--operadores", type=int, default=4, help="por estación")
+    parser.add_argument("--visores", type=int, default=8, help="por estación")
+    parser.add_argument("--estaciones", default="SPJC", help="separadas por coma")
+    parser.add_argument("--duracion", type=float, default=20.0, help="segundos")
+    parser.add_argument("--cadencia", type=float, default=1.0,
+                        help="segundos entre METAR de un operador (30 min comprimidos)")
+    parser.add_argument("--rafagas", type=float, default=0.1,
+                        help="probabilidad de una ráfaga de SPECI tras cada METAR")
+    parser.add_argument("--exportar", type=float, default=10.0,
+                        help="segundos entre descargas del Excel de cada operador")
+    parser.add_argument("--sondeo", type=float, default=1.0,
+                        help="segundos entre consultas de cada visor")
+    parser.add_argument("--max-errores", type=float, default=0.01,
+                        help="fracción de peticiones fallidas tolerada")
+    args = parser.parse_args(argv)
+
+    directorio, anterior = tempfile.mkdtemp(prefix="carga_metar_"), os.getcwd()
+    os.chdir(directorio)                  # app usa datos_metar/ relativo al directorio actual
+    try:
+        import app
+        codigos = [c.strip().upper() for c in args.estaciones.split(",") if c.strip()]
+        desconocidas = [c for c in codigos if c not in app.estaciones()]
+        if desconocidas:
+            parser.error(f"estaciones desconocidas: {', '.join(desconocidas)}")
+        _plantillas_minimas(app)
+
+        med, fin, aceptados = Mediciones(), threading.Event(), set()
+        hilos = []
+        for i, codigo in enumerate(codigos):
+            for k in range(args.operadores):
+                hilos.append(threading.Thread(target=operador, daemon=True, args=(
+                    app, med, fin, args, codigo, i * 100 + k, aceptados)))
+            for k in range(args.visores):
+                hilos.append(threading.Thread(target=visor, daemon=True, args=(
+                    app, med, fin, args, codigo, k)))
+        print(f"{len(codigos)} estación(es), {args.operadores} operadores y {args.visores} "
+              f"visores por estación, {args.duracion:.0f} s", file=sys.stderr)
+        inicio = time.perf_counter()
+        for h in hilos:
+            h.start()
+        fin.wait(args.duracion)
+        fin.set()
+        for h in hilos:
+            h.join()
+        duracion = time.perf_counter() - inicio
+
+        tasa_errores = informe(med, duracion)
+        print()
+        fallos = comprobar(app, aceptados)
+        if tasa_errores > args.max_errores:
+            fallos.append(f"{tasa_errores:.1%} de peticiones con error "
+                          f"(máximo {args.max_errores:.1%})")
+        for aero in list(app._aerodromos.values()):
+            aero.escritor.detener()
+    finally:
+        os.chdir(anterior)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    for f in fallos:
+        print("FALLO:", f)
+    if fallos:
+        sys.exit(1)
+    print("OK: sin errores por encima del límite y Excel consistentes con el almacén")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Prueba de estrés con varios procesos escribiendo el mismo mes, como varios
+workers de gunicorn atendiendo a operadores a la vez.
+
+Cada proceso guarda su parte de las observaciones (y algunas horas que
+también guardan los demás), fuerza escrituras del Excel como haría
+/exportar, y un proceso lector abre el libro sin parar mientras se
+reescribe. Al final se comprueba que no se perdió ninguna observación, que
+el Excel coincide con el almacén y que el lector nunca vio un archivo a
+medio escribir.
+
+    python benchmarks/estres_multiproceso.py [--procesos 4] [--observaciones 600]
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+from sinteticos import formularios
+
+MES = "2025_01"
+RAIZ = Path(__file__).resolve().parent.parent
+
+
+def _entrar(directorio):
+    # app usa datos_metar/ relativo al directorio actual
+    os.chdir(directorio)
+    sys.path.insert(0, str(RAIZ))
+
+
+def operador(directorio, k, procesos, n, repetidas):
+    _entrar(directorio)
+    import app
+    app.escritor.demora = 0.05
+    todos = list(formularios(n))
+    mios = todos[k::procesos] + todos[:repetidas]
+    for i, f in enumerate(mios):
+        f = dict(f, qnh=str(1000 + k))        # las repetidas difieren por proceso
+        res = app.generar_lote([f], MES)[0]
+        if not res["success"]:
+            raise SystemExit(f"proceso {k}: {res['error']}")
+        if i % 25 == 0:
+            app.escritor.vaciar(MES)          # como una descarga desde /exportar
+    app.escritor.detener()
+
+
+def lector(directorio, fin, resultado):
+    _entrar(directorio)
+    from openpyxl import load_workbook
+    archivo = Path("datos_metar") / "SPJC" / f"SPJC_METAR_{MES}.xlsx"
+    lecturas = errores = 0
+    filas_antes = 0
+    retrocesos = 0
+    while not fin.is_set():
+        if not archivo.exists():
+            time.sleep(0.01)
+            continue
+        try:
+            with open(archivo, "rb") as f:
+                zipfile.ZipFile(f).testzip()
+                f.seek(0)
+                hoja = load_workbook(f, read_only=True)["METAR SPJC"]
+                filas = sum(1 for _ in hoja.iter_rows(values_only=True)) - 1
+            lecturas += 1
+            retrocesos += filas < filas_antes
+            filas_antes = filas
+        except Exception:
+            errores += 1
+    resultado.put((lecturas, errores, retrocesos))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--procesos", type=int, default=4)
+    parser.add_argument("--observaciones", type=int, default=600)
+    parser.add_argument("--repetidas", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    ctx = mp.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directorio:
+        fin, resultado = ctx.Event(), ctx.Queue()
+        leer = ctx.Process(target=lector, args=(directorio, fin, resultado))
+        leer.start()
+        inicio = time.perf_counter()
+        ops = [ctx.Process(target=operador,
+                           args=(directorio, k, args.procesos, args.observaciones, args.repetidas))
+               for k in range(args.procesos)]
+        for p in ops:
+            p.start()
+        for p in ops:
+            p.join()
+        duracion = time.perf_counter() - inicio
+        fin.set()
+        lecturas, errores, retrocesos = resultado.get()
+        leer.join()
+
+        _entrar(directorio)
+        import app
+        almacen = list(app.almacen.registros(MES))
+        app._cache_meses.clear()
+        excel = app.cargar_registros_mes(MES)
+        esperadas = len({(f["dia"], f["hora"]) for f in formularios(args.observaciones)})
+
+        fallos = []
+        if any(p.exitcode for p in ops):
+            fallos.append("algún proceso operador terminó con error")
+        if len(almacen) != esperadas:
+            fallos.append(f"almacén: {len(almacen)} observaciones, se esperaban {esperadas}")
+        if [r.metar for r in excel] != [r.metar for r in almacen]:
+            fallos.append(f"el Excel ({len(excel)} filas) no coincide con el almacén")
+        if app.almacen.meses_pendientes():
+            fallos.append("quedaron cambios sin escribir en el Excel")
+        if errores:
+            fallos.append(f"el lector vio {errores} archivos dañados o a medio escribir")
+        if retrocesos:
+            fallos.append(f"el Excel retrocedió a una versión anterior {retrocesos} veces")
+
+        print(f"{args.procesos} procesos, {esperadas} observaciones en {duracion:.1f} s; "
+              f"{lecturas} lecturas concurrentes del Excel")
+        for f in fallos:
+            print("FALLO:", f)
+        if fallos:
+            sys.exit(1)
+        print("OK: sin pérdidas ni archivos corruptos")
+
+
+if __name__ == "__main__":
+    main()
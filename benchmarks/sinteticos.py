@@ -0,0 +1,70 @@
+"""
+Datos sintéticos de SPJC para los benchmarks.
+
+Genera formularios con la misma forma que arma /generar y los registros
+que produce generar_metar(), con una semilla fija para que las
+mediciones sean reproducibles.
+"""
+
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+FENOMENOS = ["-RA", "BR", "FG", "-DZ", "HZ", "TS"]
+
+
+def formularios(n, paso_min=30, semilla=2024):
+    """`n` formularios cada `paso_min` minutos a partir del día 01 00:00Z.
+
+    Con paso_min=30 un mes tiene 1 488 observaciones; si `n` es mayor, los
+    días vuelven a empezar (las claves día/hora se repiten).
+    """
+    rnd = random.Random(semilla)
+    for i in range(n):
+        minutos = (i * paso_min) % (31 * 24 * 60)
+        dia, resto = divmod(minutos, 24 * 60)
+        hora = f"{resto // 60:02d}{resto % 60:02d}"
+        speci = rnd.random() < 0.08
+        temp  = round(rnd.uniform(14, 27), 1)
+        vis   = rnd.choice(["10km", "8000", "6000", "4000", "1200"])
+        nubes = [] if vis == "10km" and rnd.random() < 0.5 else [
+            {"octas": rnd.randint(1, 8), "tipo": rnd.choice(["ST", "SC", "CU", "CB"]),
+             "altura_m": rnd.choice([150, 300, 450, 600, 900])}]
+        sup = "PP000"
+        if hora == "1200":
+            sup += " TN15/"
+        elif hora == "2200":
+            sup += " TX26/"
+        yield {
+            "tipo":          "SPECI" if speci else "METAR",
+            "dia":           f"{dia + 1:02d}",
+            "hora":          hora,
+            "dir_viento":    f"{rnd.randrange(0, 360, 10):03d}",
+            "int_viento":    rnd.choice(["04", "08", "12", "15G25"]),
+            "var_viento":    rnd.choice(["", "", "", "140V220"]),
+            "vis":           vis,
+            "vis_min":       "",
+            "rvr":           "",
+            "fenomenos":     [rnd.choice(FENOMENOS)] if vis != "10km" else [],
+            "nubes":         nubes,
+            "temp":          str(temp),
+            "rocio":         str(round(temp - rnd.uniform(0, 6), 1)),
+            "hr":            "",
+            "qnh":           str(rnd.randint(1008, 1016)),
+            "presion":       "",
+            "suplementaria": sup + " NOSIG",
+        }
+
+
+def registros(n, paso_min=30, semilla=2024):
+    """Registros ya codificados por generar_metar()."""
+    from codificador import generar_metar
+    salida = []
+    for datos in formularios(n, paso_min, semilla):
+        res = generar_metar(datos)
+        if not res["success"]:
+            raise RuntimeError(f"{datos['dia']}{datos['hora']}Z: {res['error']}")
+        salida.append(res["registro"])
+    return salida
@@ -0,0 +1,264 @@
+"""
+Suite de benchmarks de los caminos críticos, con datos sintéticos de SPJC.
+
+Mide la codificación (generar_metar, redondear_metar), el upsert a
+distintos tamaños de mes, guardar/cargar el Excel con un día, un mes y un
+año de observaciones cada 30 min, y la latencia de /generar de punta a
+punta con el cliente de pruebas de Flask, y el tiempo de import en frío de
+codificador y app. Informa percentiles en ms.
+
+    python benchmarks/suite.py                       # compara con linea_base.json si existe
+    python benchmarks/suite.py --guardar             # guarda la línea base de esta máquina
+    python benchmarks/suite.py --solo excel,http --umbral 0.30
+
+Termina con código 1 si la mediana de alguna métrica empeora más que
+`--umbral` (25 % por defecto) respecto de la línea base, o si se pasa de
+un presupuesto absoluto (PRESUPUESTOS; p. ej. importar codificador sin
+Flask ni pandas). Las líneas base dependen de la máquina: se guardan
+localmente y no van al repositorio.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sinteticos import formularios, registros
+
+RAIZ = Path(__file__).resolve().parent.parent
+LINEA_BASE = Path(__file__).resolve().parent / "linea_base.json"
+CASOS = {}
+
+# Límites absolutos (p50 en ms), se cumplan o no respecto de la línea base
+PRESUPUESTOS = {"arranque/importar_codificador": 60.0}
+# Módulos que no debe cargar `import codificador`
+PESADOS = ("flask", "pandas", "numpy", "openpyxl")
+FALLOS = []
+
+# Diferencias menores que esto (ms) se consideran ruido aunque superen el umbral
+RUIDO_MS = 0.05
+
+
+def caso(nombre):
+    def registrar(funcion):
+        CASOS[nombre] = funcion
+        return funcion
+    return registrar
+
+
+def cronometrar(funcion, repeticiones, *args):
+    """Duración de cada llamada, en segundos."""
+    muestras = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        funcion(*args)
+        muestras.append(time.perf_counter() - t0)
+    return muestras
+
+
+def percentiles(muestras):
+    ms = sorted(m * 1000 for m in muestras)
+    def p(q):
+        return ms[min(len(ms) - 1, int(q * len(ms)))]
+    return {"n": len(ms), "min": ms[0], "p50": statistics.median(ms),
+            "p90": p(0.90), "p99": p(0.99), "media": statistics.fmean(ms)}
+
+
+# ─────────────────────────────────────────────
+# CASOS
+# ─────────────────────────────────────────────
+@caso("codificacion")
+def _codificacion(app, escala):
+    datos = list(formularios(1488))
+    res = {"generar_metar": [], "redondear_metar_x1000": []}
+    for d in datos[:int(1488 * escala)]:
+        res["generar_metar"] += cronometrar(app.generar_metar, 1, d)
+    valores = [str(random.Random(1).uniform(-5, 40)) for _ in range(1000)]
+    def mil_redondeos():
+        for v in valores:
+            app.redondear_metar(v)
+    res["redondear_metar_x1000"] = cronometrar(mil_redondeos, max(5, int(50 * escala)))
+    return res
+
+
+@caso("upsert")
+def _upsert(app, escala):
+    todos = registros(1488)
+    rnd = random.Random(7)
+    res = {}
+    for n in (48, 744, 1488):
+        mes = f"2030_{n % 12 + 1:02d}"
+        base = todos[:n]
+        contenedor = app.RegistrosMes(base)
+        res[f"registros_mes_{n}"] = [
+            t for r in rnd.choices(base, k=int(500 * escala))
+            for t in cronometrar(contenedor.actualizar_o_insertar, 1, r)]
+        app.almacen.actualizar_o_insertar_lote(mes, base)
+        res[f"almacen_{n}"] = [
+            t for r in rnd.choices(base, k=int(100 * escala))
+            for t in cronometrar(app.almacen.actualizar_o_insertar, 1, mes, r)]
+    return res
+
+
+@caso("excel")
+def _excel(app, escala):
+    mes_completo = registros(1488)
+    tamanos = {"dia": {"2031_01": mes_completo[:48]},
+               "mes": {"2031_02": mes_completo},
+               "anio": {f"2032_{m:02d}": mes_completo for m in range(1, 13)}}
+    res = {}
+    for nombre, meses in tamanos.items():
+        repeticiones = 1 if nombre == "anio" and escala < 1 else 3
+        def guardar():
+            for mes, regs in meses.items():
+                app.guardar_registros_mes(regs, mes)
+        def cargar():
+            app._cache_meses.clear()
+            for mes in meses:
+                app.cargar_registros_mes(mes)
+        res[f"guardar_{nombre}"] = cronometrar(guardar, repeticiones)
+        res[f"cargar_{nombre}"]  = cronometrar(cargar, repeticiones)
+        res[f"cargar_cache_{nombre}"] = cronometrar(
+            lambda: [app.cargar_registros_mes(mes) for mes in meses], 10)
+    return res
+
+
+@caso("http")
+def _http(app, escala):
+    cliente = app.app.test_client()
+    cliente.post("/login", data={"usuario": "admin", "password": "corpac2024"})
+    muestras = []
+    for d in list(formularios(1488))[:int(300 * escala)]:
+        # El borrador se arma con la API, como en carga_operadores.py; solo
+        # se cronometra /generar
+        cliente.delete("/api/borrador")
+        for codigo in d["fenomenos"]:
+            cliente.post("/api/borrador/fenomenos", json={"codigo": codigo})
+        for capa in d["nubes"]:
+            cliente.post("/api/borrador/nubes", json=capa)
+        formulario = {k: v for k, v in d.items() if k not in ("fenomenos", "nubes")}
+        t0 = time.perf_counter()
+        r = cliente.post("/generar", data=formulario)
+        muestras.append(time.perf_counter() - t0)
+        assert r.status_code == 302, r.status_code
+    return {"generar": muestras}
+
+
+@caso("arranque")
+def _arranque(app, escala):
+    """Import en frío en un intérprete nuevo (sin contar el arranque de Python)."""
+    def importar(modulo):
+        codigo = (f"import sys, time; t = time.perf_counter(); import {modulo}; "
+                  f"print(time.perf_counter() - t); "
+                  f"print(','.join(m for m in {PESADOS!r} if m in sys.modules))")
+        salida = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True,
+                                check=True, cwd=os.getcwd(),
+                                env=dict(os.environ, PYTHONPATH=str(RAIZ))).stdout.split("\n")
+        return float(salida[0]), salida[1]
+    res = {}
+    for modulo in ("codificador", "app"):
+        muestras = []
+        for _ in range(max(3, int(10 * escala))):
+            segundos, cargados = importar(modulo)
+            muestras.append(segundos)
+        if modulo == "codificador" and cargados:
+            FALLOS.append(f"import codificador carga {cargados}")
+        res[f"importar_{modulo}"] = muestras
+    return res
+
+
+# ─────────────────────────────────────────────
+# EJECUCIÓN
+# ─────────────────────────────────────────────
+def ejecutar(nombres, escala):
+    # Todo ocurre en un directorio temporal: app crea datos_metar/ relativo al actual
+    directorio, anterior = tempfile.mkdtemp(prefix="bench_metar_"), os.getcwd()
+    os.chdir(directorio)
+    import app
+    app.escritor.demora = 3600          # que el hilo del Excel no interfiera con las mediciones
+    resultados = {}
+    try:
+        for nombre in nombres:
+            t0 = time.perf_counter()
+            for metrica, muestras in CASOS[nombre](app, escala).items():
+                resultados[f"{nombre}/{metrica}"] = percentiles(muestras)
+            print(f"  {nombre}: {time.perf_counter() - t0:.1f} s", file=sys.stderr)
+    finally:
+        app.escritor.detener()
+        os.chdir(anterior)
+        shutil.rmtree(directorio, ignore_errors=True)
+    return resultados
+
+
+def comparar(actual, base, umbral):
+    """Métricas cuya mediana empeoró más que `umbral`."""
+    peores = []
+    for clave, m in actual.items():
+        b = base.get(clave)
+        if not b:
+            continue
+        if m["p50"] > b["p50"] * (1 + umbral) and m["p50"] - b["p50"] > RUIDO_MS:
+            peores.append((clave, b["p50"], m["p50"]))
+    return peores
+
+
+def imprimir(resultados, base):
+    print(f"{'métrica':<36}{'n':>6}{'p50':>10}{'p90':>10}{'p99':>10}{'base p50':>10}{'Δ':>8}")
+    for clave, m in resultados.items():
+        b = base.get(clave, {}).get("p50")
+        columnas_base = f"{b:>10.3f}{(m['p50'] / b - 1) * 100:>+7.0f}%" if b else f"{'-':>10}{'':>8}"
+        print(f"{clave:<36}{m['n']:>6}{m['p50']:>10.3f}{m['p90']:>10.3f}{m['p99']:>10.3f}{columnas_base}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de METAR SPJC")
+    parser.add_argument("--solo", help=f"casos separados por coma ({', '.join(CASOS)})")
+    parser.add_argument("--rapido", action="store_true", help="menos repeticiones")
+    parser.add_argument("--guardar", nargs="?", const=str(LINEA_BASE), metavar="RUTA",
+                        help="guarda los resultados como línea base")
+    parser.add_argument("--comparar", default=str(LINEA_BASE), metavar="RUTA")
+    parser.add_argument("--umbral", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    nombres = args.solo.split(",") if args.solo else list(CASOS)
+    desconocidos = [n for n in nombres if n not in CASOS]
+    if desconocidos:
+        parser.error(f"casos desconocidos: {', '.join(desconocidos)}")
+
+    resultados = ejecutar(nombres, 0.3 if args.rapido else 1.0)
+    ruta_base = Path(args.comparar)
+    base = json.loads(ruta_base.read_text(encoding="utf-8"))["metricas"] if ruta_base.exists() else {}
+    imprimir(resultados, base)
+
+    if args.guardar:
+        Path(args.guardar).write_text(json.dumps({
+            "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "maquina": platform.node(),
+            "metricas": resultados,
+        }, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\nLínea base guardada en {args.guardar}")
+        return
+
+    peores = comparar(resultados, base, args.umbral)
+    for clave, antes, ahora in peores:
+        print(f"REGRESIÓN {clave}: p50 {antes:.3f} ms -> {ahora:.3f} ms")
+    for clave, limite in PRESUPUESTOS.items():
+        if clave in resultados and resultados[clave]["p50"] > limite:
+            FALLOS.append(f"{clave}: p50 {resultados[clave]['p50']:.1f} ms supera {limite:.0f} ms")
+    for fallo in FALLOS:
+        print("FUERA DE PRESUPUESTO", fallo)
+    if peores or FALLOS:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Bloqueo de archivos entre procesos (varios workers de gunicorn, el
+importador de boletines, etc.).
+
+    with bloqueo_archivo(Path("datos_metar/SPJC_METAR_2025_01.xlsx.lock")):
+        ...   # solo un proceso a la vez
+
+Usa fcntl.flock en Linux/macOS y msvcrt.locking en Windows. El bloqueo se
+libera solo si el proceso muere, así que no quedan candados huérfanos.
+"""
+
+from contextlib import contextmanager
+import os
+
+try:
+    import fcntl
+except ImportError:                    # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def bloqueo_archivo(ruta):
+    """Bloqueo exclusivo sobre `ruta` (se crea si no existe); espera a tenerlo."""
+    fd = os.open(ruta, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:        # LK_LOCK se rinde tras ~10 s; seguir esperando
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
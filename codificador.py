@@ -0,0 +1,234 @@
+"""
+Codificación de METAR/SPECI a partir de los datos del formulario.
+
+Son las reglas de siempre de /generar, separadas de la aplicación web para
+que los procesos por lotes, la línea de comandos y los benchmarks puedan
+importarlas sin cargar Flask, pandas ni openpyxl.
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from estaciones import ESTACION, reglas
+from registro import RegistroMetar, capas_desde_formulario
+
+
+def redondear_metar(valor):
+    try:
+        return int(Decimal(str(valor)).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+    except Exception:
+        return int(round(float(valor)))
+
+
+def procesar_viento(direccion, intensidad, variacion):
+    dir_int = int(direccion)
+    intensidad_str = str(intensidad).upper().strip()
+    if dir_int == 0 and intensidad_str == "00":
+        return "00000KT"
+    if "G" in intensidad_str:
+        partes = intensidad_str.split("G")
+        intensidad_metar = f"{int(partes[0]):02d}G{int(partes[1]):02d}"
+        int_base = int(partes[0])
+    else:
+        int_base = int(intensidad_str)
+        intensidad_metar = f"{int_base:02d}"
+    if not variacion:
+        return f"{dir_int:03d}{intensidad_metar}KT"
+    try:
+        variacion = variacion.upper().replace(" ", "")
+        if "V" not in variacion:
+            return f"{dir_int:03d}{intensidad_metar}KT"
+        desde, hasta = map(int, variacion.split("V"))
+        diff1 = abs(hasta - desde)
+        diferencia = diff1 if desde < hasta else 360 - diff1
+        if diferencia < 60:
+            return f"{dir_int:03d}{intensidad_metar}KT"
+        if diferencia >= 180 or int_base < 3:
+            return f"VRB{intensidad_metar}KT"
+        d1, d2 = (desde, hasta) if desde < hasta else (hasta, desde)
+        return f"{dir_int:03d}{intensidad_metar}KT {d1:03d}V{d2:03d}"
+    except Exception:
+        return f"{dir_int:03d}{intensidad_metar}KT"
+
+
+def convertir_visibilidad(vis_texto):
+    vis_texto = vis_texto.strip().upper()
+    if not vis_texto:
+        raise ValueError("Visibilidad es obligatoria")
+    try:
+        if vis_texto.endswith("KM"):
+            km = float(vis_texto[:-2])
+            return 9999 if km >= 10 else int(km * 1000)
+        elif vis_texto.endswith("M"):
+            return int(vis_texto[:-1])
+        else:
+            metros = int(vis_texto)
+            return 9999 if metros >= 10000 else metros
+    except Exception:
+        raise ValueError("Formato de visibilidad inválido")
+
+
+def procesar_visibilidad_minima(vis_min_texto, vis_m):
+    if not vis_min_texto:
+        return "", ""
+    vis_min_texto = vis_min_texto.strip().upper()
+    cuadrante = ""
+    valor = vis_min_texto
+    for cq in ["NW", "NE", "SW", "SE", "N", "S", "E", "W"]:
+        if vis_min_texto.endswith(cq):
+            cuadrante = cq
+            valor = vis_min_texto[:-len(cq)]
+            break
+    try:
+        if valor.endswith("KM"):
+            vis_min_m = 9999 if float(valor[:-2]) >= 10 else int(float(valor[:-2]) * 1000)
+        elif valor.endswith("M"):
+            vis_min_m = int(valor[:-1])
+        else:
+            vis_min_m = int(valor)
+            vis_min_m = 9999 if vis_min_m >= 10000 else vis_min_m
+        if not (vis_min_m < 1500 or (vis_min_m < vis_m * 0.5 and vis_min_m < 5000)):
+            return "", "No cumple reglas de visibilidad mínima"
+        return f"{vis_min_m:04d}{cuadrante}", ""
+    except Exception:
+        return "", "Formato inválido"
+
+
+def procesar_rvr(rvr_texto):
+    return rvr_texto.strip() if rvr_texto else ""
+
+
+def interpretar_nubes_lista(nubes_lista, vis_m, fenomeno):
+    if not nubes_lista:
+        if vis_m >= 9999 and not fenomeno.strip():
+            return "CAVOK"
+        return "NSC"
+    codigos = []
+    for capa in nubes_lista[:4]:
+        octas     = int(capa.get("octas", 0))
+        tipo_nube = capa.get("tipo", "SC").upper()
+        altura_m  = int(capa.get("altura_m", 300))
+        if octas <= 2:   cod = "FEW"
+        elif octas <= 4: cod = "SCT"
+        elif octas <= 7: cod = "BKN"
+        else:            cod = "OVC"
+        altura_ft = max(1, min(round(altura_m / 30), 999))
+        codigo = f"{cod}{altura_ft:03d}"
+        if tipo_nube in ("CB", "TCU"):
+            codigo += tipo_nube
+        if codigo not in codigos:
+            codigos.append(codigo)
+    return " ".join(codigos) if codigos else "NSC"
+
+
+def validar_info_suplementaria(hora, texto, estacion=ESTACION):
+    if not texto or not texto.strip():
+        return False, "Falta información suplementaria obligatoria: precipitación PPxxx"
+    partes = texto.strip().upper().split()
+    tiene_precip = any(
+        p.startswith("PP") and len(p) >= 4
+        and p[2:5].replace("T","").replace("R","").replace("Z","").isdigit()
+        for p in partes
+    )
+    if not tiene_precip:
+        return False, "Falta precipitación: debe incluir PPxxx (ej: PP000, PP001, PPTRZ)"
+    if hora and hora.isdigit() and len(hora) == 4:
+        r = reglas(estacion)
+        if hora == r.hora_tn and not any(p.startswith("TN") for p in partes):
+            return False, f"Las {hora[:2]}Z requieren temperatura mínima (TNxxx)"
+        if hora == r.hora_tx and not any(p.startswith("TX") for p in partes):
+            return False, f"Las {hora[:2]}Z requieren temperatura máxima (TXxxx)"
+    return True, ""
+
+
+def validar_temp_qnh(temp, rocio, qnh):
+    """Valida T, Td y QNH; devuelve (temp, rocio, qnh, t_m, r_m, q_m)."""
+    temp  = float(temp)
+    rocio = float(rocio)
+    qnh   = float(qnh)
+    if rocio > temp:
+        raise ValueError(f"Rocío ({rocio}°C) no puede ser > Temperatura ({temp}°C)")
+    if not (-10 <= temp <= 40):
+        raise ValueError("Temperatura fuera de rango (-10 a 40°C)")
+    if not (850 <= qnh <= 1100):
+        raise ValueError("QNH fuera de rango (850-1100 hPa)")
+    return temp, rocio, qnh, redondear_metar(temp), redondear_metar(rocio), int(qnh)
+
+
+def generar_metar(datos, numericos=None, estacion=ESTACION):
+    """Codifica un formulario para `estacion`. `numericos` es el resultado
+    de validar_temp_qnh() ya calculado (o su ValueError), como lo entrega
+    generar_lote()."""
+    try:
+        if not datos["dir_viento"] or not datos["int_viento"]:
+            raise ValueError("Dirección e intensidad del viento son obligatorias")
+        if not datos["vis"]:
+            raise ValueError("Visibilidad es obligatoria")
+        if not datos["temp"] or not datos["rocio"] or not datos["qnh"]:
+            raise ValueError("Temperatura, Rocío y QNH son obligatorios")
+
+        hora = datos["hora"]
+        if not hora or len(hora) != 4 or not hora.isdigit():
+            raise ValueError("Hora debe ser HHMM (4 dígitos)")
+
+        viento  = procesar_viento(datos["dir_viento"], datos["int_viento"], datos["var_viento"])
+        vis_m   = convertir_visibilidad(datos["vis"])
+        vis_min_codigo = ""
+        if datos["vis_min"]:
+            vis_min_codigo, err = procesar_visibilidad_minima(datos["vis_min"], vis_m)
+            if err:
+                raise ValueError(err)
+        rvr_codigo = procesar_rvr(datos["rvr"])
+        fenomeno   = " ".join(datos["fenomenos"][:3]) if datos["fenomenos"] else ""
+        nubes      = interpretar_nubes_lista(datos["nubes"], vis_m, fenomeno)
+
+        if numericos is None:
+            numericos = validar_temp_qnh(datos["temp"], datos["rocio"], datos["qnh"])
+        elif isinstance(numericos, Exception):
+            raise numericos
+        temp, rocio, qnh, t_m, r_m, q_m = numericos
+
+        es_valida, err_sup = validar_info_suplementaria(hora, datos["suplementaria"], estacion)
+        if not es_valida:
+            raise ValueError(err_sup)
+
+        partes = [f"{datos['tipo']} {estacion} {datos['dia']}{hora}Z {viento}"]
+        if nubes == "CAVOK":
+            partes.append("CAVOK")
+        else:
+            partes.append(f"{vis_m:04d}")
+            if vis_min_codigo: partes.append(vis_min_codigo)
+            if rvr_codigo:     partes.append(rvr_codigo)
+            if fenomeno:       partes.append(fenomeno)
+            partes.append(nubes)
+        partes.append(f"{t_m:02d}/{r_m:02d} Q{q_m}")
+        sup = datos["suplementaria"].strip().upper() if datos["suplementaria"] else ""
+        if sup:
+            partes.append(sup)
+        metar = " ".join(partes) + "="
+
+        registro = RegistroMetar(
+            dia             = datos["dia"],
+            hora            = hora,
+            tipo            = datos["tipo"],
+            dir_viento      = datos["dir_viento"],
+            int_viento      = datos["int_viento"],
+            var_viento      = datos["var_viento"],
+            vis_original    = datos["vis"],
+            vis_metros      = vis_m,
+            vis_minima      = vis_min_codigo,
+            rvr             = rvr_codigo,
+            fenomeno_texto  = fenomeno,
+            fenomeno_codigo = fenomeno,
+            nubes           = capas_desde_formulario(datos["nubes"]),
+            nubes_codigo    = nubes,
+            temperatura     = temp,
+            rocio           = rocio,
+            humedad         = datos.get("hr", ""),
+            qnh             = qnh,
+            presion         = datos.get("presion", ""),
+            suplementaria   = datos.get("suplementaria", ""),
+            metar           = metar,
+        )
+        return {"success": True, "metar": metar, "registro": registro}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
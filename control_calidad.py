@@ -0,0 +1,221 @@
+"""
+Control de calidad de la secuencia de observaciones del mes.
+
+generar_metar() valida cada boletín por separado; aquí se compara cada uno
+con el anterior en el tiempo:
+
+- qnh:    el QNH cambia más de QNH_HPA_POR_HORA respecto del boletín anterior
+- temp:   la temperatura cambia más de TEMP_C_POR_HORA
+- hueco:  faltan METAR de las :00/:30 entre el METAR anterior y este
+- speci:  entre el boletín anterior y este METAR se cruzó un criterio de
+          SPECI (visibilidad, techo, viento, comienzo o fin de TS/FG) sin
+          que se emitiera un SPECI
+
+Las reglas son vectoriales, sobre las columnas de archivo_columnar, y son
+las mismas para auditar() (el mes completo de una pasada, p. ej. datos
+importados) y para ControlCalidad, que al cambiar un registro solo revisa
+ese registro y los que lo tienen como anterior.
+
+    python control_calidad.py --mes 2019_03 [--estacion SPQU]
+"""
+
+import argparse
+import threading
+
+import numpy as np
+
+from archivo_columnar import a_columnas
+
+QNH_HPA_POR_HORA = 3.0
+TEMP_C_POR_HORA  = 5.0
+HORAS_MINIMAS    = 0.5          # cambios en menos tiempo se comparan como si fuera media hora
+MINUTOS_METAR    = 30
+UMBRALES_VIS     = [800, 1500, 3000, 5000]          # m
+UMBRALES_TECHO   = [100, 200, 500, 1000, 1500]      # ft
+SIN_TECHO        = 100_000
+COLUMNA          = "CONTROL CALIDAD"                # columna extra del Excel
+MAX_INCREMENTAL  = 64           # con más cambios juntos (p. ej. una importación) se audita el mes
+
+
+def _cruza(antes, despues, umbrales):
+    """Algún umbral quedó entre `antes` y `despues` (en cualquier sentido)."""
+    return np.digitize(antes, umbrales) != np.digitize(despues, umbrales)
+
+
+def _con(wx, fenomeno):
+    """El grupo `fenomeno` aparece como tal (FG sí, BCFG o VCFG no)."""
+    return np.char.find(np.char.add(np.char.add(b" ", wx), b" "), b" " + fenomeno + b" ") >= 0
+
+
+def _techo(d):
+    return np.where(d["techo"] < 0, SIN_TECHO, d["techo"])
+
+
+def reglas(ant, act):
+    """{regla: máscara} de cada par (ant[i], act[i]) de boletines seguidos."""
+    horas = np.maximum((act["fecha"] - ant["fecha"]).astype(float) / 60, HORAS_MINIMAS)
+    d_ant, d_act = ant["dir"].astype(int), act["dir"].astype(int)
+    v_ant, v_act = ant["viento"].astype(int), act["viento"].astype(int)
+    # VRB (-1) no tiene dirección media: solo cuenta el cambio de intensidad
+    giro = np.abs(d_act - d_ant) % 360
+    giro = np.minimum(giro, 360 - giro)
+    viento = ((giro >= 60) & (d_ant >= 0) & (d_act >= 0) & (np.maximum(v_ant, v_act) >= 10)) \
+        | (np.abs(v_act - v_ant) >= 10)
+    tormenta = [np.char.find(d["wx"], b"TS") >= 0 for d in (ant, act)]
+    niebla   = [_con(d["wx"], b"FG") for d in (ant, act)]
+    cruce = (_cruza(ant["vis"], act["vis"], UMBRALES_VIS)
+             | _cruza(_techo(ant), _techo(act), UMBRALES_TECHO)
+             | viento
+             | (tormenta[0] != tormenta[1])
+             | (niebla[0] != niebla[1]))
+    with np.errstate(invalid="ignore"):
+        return {
+            "qnh":   np.abs(act["qnh"] - ant["qnh"]) / horas > QNH_HPA_POR_HORA,
+            "temp":  np.abs(act["temp"] - ant["temp"]) / horas > TEMP_C_POR_HORA,
+            "speci": (act["tipo"] == b"METAR") & cruce,
+        }
+
+
+def faltantes(ant, act):
+    """METAR que faltan entre cada par de METAR seguidos."""
+    return np.maximum((act["fecha"] - ant["fecha"]).astype(int) // MINUTOS_METAR - 1, 0)
+
+
+def _hora(fila):
+    f = fila["fecha"].astype(object)
+    return f"{f.day:02d}/{f.hour:02d}{f.minute:02d}Z"
+
+
+def _clave(fila):
+    f = fila["fecha"].astype(object)
+    return f"{f.day:02d}", f"{f.hour:02d}{f.minute:02d}"
+
+
+def _mensaje(regla, a, b):
+    if regla == "qnh":
+        return f"QNH {a['qnh']:.0f} → {b['qnh']:.0f} hPa desde {_hora(a)}"
+    if regla == "temp":
+        return f"Temperatura {a['temp']:.1f} → {b['temp']:.1f} °C desde {_hora(a)}"
+    return f"Cambio respecto de {_hora(a)} que requería SPECI"
+
+
+def _anotar(banderas, ant, act):
+    for regla, mascara in reglas(ant, act).items():
+        for i in np.flatnonzero(mascara):
+            banderas.setdefault(_clave(act[i]), []).append(
+                {"regla": regla, "mensaje": _mensaje(regla, ant[i], act[i])})
+
+
+def _anotar_huecos(banderas, ant, act):
+    n = faltantes(ant, act)
+    for i in np.flatnonzero(n):
+        banderas.setdefault(_clave(act[i]), []).append(
+            {"regla": "hueco", "mensaje": f"Faltan {n[i]} METAR desde {_hora(ant[i])}"})
+
+
+def auditar(mes, registros):
+    """{(día, hora): [banderas]} del mes completo, en una sola pasada."""
+    d = a_columnas(mes, registros)
+    d = d[np.argsort(d["fecha"], kind="stable")]
+    banderas = {}
+    if len(d) > 1:
+        _anotar(banderas, d[:-1], d[1:])
+    m = d[d["tipo"] == b"METAR"]
+    if len(m) > 1:
+        _anotar_huecos(banderas, m[:-1], m[1:])
+    return banderas
+
+
+def revisar(mes, registros, clave):
+    """Banderas de un solo registro de `registros` (RegistrosMes), contra
+    el boletín anterior y, si es METAR, contra el METAR anterior."""
+    r = registros.obtener(*clave)
+    if r is None:
+        return []
+    banderas = {}
+    act = a_columnas(mes, [r])
+    anterior = registros.anterior(clave)
+    if len(act) and anterior is not None:
+        ant = a_columnas(mes, [anterior])
+        if len(ant):
+            _anotar(banderas, ant, act)
+    metar_anterior = registros.anterior(clave, "METAR") if r.tipo == "METAR" else None
+    if len(act) and metar_anterior is not None:
+        ant = a_columnas(mes, [metar_anterior])
+        if len(ant):
+            _anotar_huecos(banderas, ant, act)
+    return banderas.get(clave, [])
+
+
+def texto(banderas):
+    """Texto de la columna COLUMNA del Excel."""
+    return "; ".join(b["mensaje"] for b in banderas or ())
+
+
+class ControlCalidad:
+    """Banderas por (estación, mes), al día con el almacén de a un registro.
+
+    Como CacheEstadisticas: `invalidar()` anota las claves (día, hora) que
+    cambiaron y la próxima consulta revisa solo esas, el boletín siguiente
+    y el METAR siguiente (los únicos que las tienen como anterior). Si los
+    avisos no llegan en cadena (p. ej. escribió otro proceso) o cambiaron
+    más de MAX_INCREMENTAL registros, se audita el mes completo.
+    """
+
+    def __init__(self):
+        self._meses = {}
+        self._lock = threading.Lock()
+
+    def invalidar(self, estacion, mes, claves, version_anterior, version_nueva):
+        with self._lock:
+            e = self._meses.get((estacion, mes))
+            if e is None:
+                return
+            if claves is None or e["esperada"] != version_anterior:
+                del self._meses[(estacion, mes)]
+                return
+            e["sucias"] |= set(claves)
+            e["esperada"] = version_nueva
+
+    def obtener(self, estacion, mes, version, registros):
+        """{(día, hora): [banderas]} de `registros` (RegistrosMes) en `version`."""
+        with self._lock:
+            e = self._meses.get((estacion, mes))
+            if e and e["version"] == version:
+                return e["banderas"]
+            if e and e["esperada"] == version and len(e["sucias"]) <= MAX_INCREMENTAL:
+                banderas = dict(e["banderas"])
+                por_revisar = set()
+                for clave in e["sucias"]:
+                    por_revisar.add(clave)
+                    for siguiente in (registros.siguiente(clave), registros.siguiente(clave, "METAR")):
+                        if siguiente is not None:
+                            por_revisar.add(siguiente.clave)
+                for clave in por_revisar:
+                    banderas.pop(clave, None)
+                    nuevas = revisar(mes, registros, clave)
+                    if nuevas:
+                        banderas[clave] = nuevas
+            else:
+                banderas = auditar(mes, registros)
+            self._meses[(estacion, mes)] = {"version": version, "esperada": version,
+                                            "sucias": set(), "banderas": banderas}
+            return banderas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Auditoría de calidad de un mes")
+    parser.add_argument("--mes", required=True, help="AAAA_MM")
+    parser.add_argument("--estacion", default="SPJC")
+    args = parser.parse_args(argv)
+    import app
+    registros = app.aerodromo(args.estacion.upper()).almacen.registros(args.mes)
+    banderas = auditar(args.mes, registros)
+    for (dia, hora), lista in sorted(banderas.items()):
+        for b in lista:
+            print(f"{dia}/{hora}Z  {b['regla']:<6} {b['mensaje']}")
+    print(f"{len(registros)} registros, {len(banderas)} con observaciones")
+
+
+if __name__ == "__main__":
+    main()
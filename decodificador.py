@@ -0,0 +1,283 @@
+"""
+Decodificador de boletines METAR/SPECI para importar archivos históricos.
+
+Convierte líneas "METAR SPJC DDHHMMZ ...=" en los mismos RegistroMetar que
+produce generar_metar(). Con --estacion se rechazan los boletines de otros
+aeródromos. La lectura es un generador, así que la memoria no
+depende del tamaño del archivo; los archivos grandes se reparten en
+bloques entre varios procesos.
+
+    python decodificador.py boletines.txt --mes 2019_03 [--estacion SPQU] [--procesos 4]
+
+Las líneas pueden empezar con la fecha AAAAMMDDHHMM (formato Ogimet); si
+no la tienen, se usa el mes indicado con --mes.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import argparse
+import os
+import re
+import time
+
+from registro import CapaNube, RegistroMetar
+
+RE_FECHA   = re.compile(r"^(\d{4})(\d{2})\d{6}\s+")
+RE_HORA    = re.compile(r"^(\d{2})(\d{4})Z$")
+RE_VIENTO  = re.compile(r"^(\d{3}|VRB)(\d{2,3})(?:G(\d{2,3}))?KT$")
+RE_VARIAC  = re.compile(r"^(\d{3})V(\d{3})$")
+RE_VIS     = re.compile(r"^\d{4}$")
+RE_VIS_MIN = re.compile(r"^\d{4}(?:NE|NW|SE|SW|N|S|E|W)$")
+RE_RVR     = re.compile(r"^R\d{2}[LCR]?/")
+RE_WX      = re.compile(r"^(?:[-+]|VC)?(?:MI|BC|PR|DR|BL|SH|TS|FZ)?"
+                        r"(?:DZ|RA|SN|SG|IC|PL|GR|GS|UP|BR|FG|FU|VA|DU|SA|HZ|PO|SQ|FC|SS|DS)*$")
+RE_NUBE    = re.compile(r"^(FEW|SCT|BKN|OVC)(\d{3})(CB|TCU)?$")
+RE_TEMP    = re.compile(r"^(M?-?\d{1,2})/(M?-?\d{1,2})$")
+RE_QNH     = re.compile(r"^Q(\d{4})$")
+
+# Octas mínimas de cada cantidad, según interpretar_nubes_lista()
+OCTAS = {"FEW": 1, "SCT": 3, "BKN": 5, "OVC": 8}
+
+
+def _temperatura(texto):
+    return -float(texto[1:]) if texto.startswith("M") else float(texto)
+
+
+def decodificar_metar(texto, estacion=None):
+    """Decodifica un boletín; ValueError si no tiene la forma esperada o si
+    es de otra estación que `estacion`."""
+    tokens = texto.strip().rstrip("=").split()
+    i = 0
+    tipo = "METAR"
+    if tokens and tokens[0] in ("METAR", "SPECI"):
+        tipo = tokens[0]
+        i += 1
+    if i < len(tokens) and tokens[i] == "COR":
+        i += 1
+    if i + 2 >= len(tokens) or not re.fullmatch(r"[A-Z]{4}", tokens[i]):
+        raise ValueError("Falta el indicador de estación")
+    if estacion and tokens[i] != estacion:
+        raise ValueError(f"Boletín de otra estación: {tokens[i]}")
+    i += 1
+
+    m = RE_HORA.match(tokens[i])
+    if not m:
+        raise ValueError(f"Fecha/hora inválida: {tokens[i]}")
+    dia, hora = m.groups()
+    i += 1
+
+    m = RE_VIENTO.match(tokens[i])
+    if not m:
+        raise ValueError(f"Viento inválido: {tokens[i]}")
+    direccion, intensidad, racha = m.groups()
+    int_viento = f"{intensidad}G{racha}" if racha else intensidad
+    var_viento = ""
+    i += 1
+    if i < len(tokens) and RE_VARIAC.match(tokens[i]):
+        var_viento = tokens[i]
+        i += 1
+    if direccion == "VRB":
+        # El codificador pone VRB con variación >= 180°, o >= 60° e intensidad < 3
+        direccion, var_viento = "000", "000V180"
+
+    vis_original, vis_m, vis_min, rvr, wx, nubes, capas = "", 9999, "", [], [], [], []
+    if i < len(tokens) and tokens[i] == "CAVOK":
+        vis_original, nubes_codigo = "9999", "CAVOK"
+        i += 1
+    else:
+        if i < len(tokens) and RE_VIS.match(tokens[i]):
+            vis_original, vis_m = tokens[i], int(tokens[i])
+            i += 1
+        if i < len(tokens) and RE_VIS_MIN.match(tokens[i]):
+            vis_min = tokens[i]
+            i += 1
+        while i < len(tokens) and RE_RVR.match(tokens[i]):
+            rvr.append(tokens[i])
+            i += 1
+        while i < len(tokens) and not RE_TEMP.match(tokens[i]):
+            tok = tokens[i]
+            m = RE_NUBE.match(tok)
+            if m:
+                cantidad, altura, tipo_nube = m.groups()
+                nubes.append(tok)
+                capas.append(CapaNube(OCTAS[cantidad], tipo_nube or "", int(altura) * 30))
+            elif tok in ("NSC", "NCD") or tok.startswith("VV"):
+                nubes.append(tok)
+            elif tok and RE_WX.match(tok):
+                wx.append(tok)
+            else:
+                raise ValueError(f"Grupo no reconocido: {tok}")
+            i += 1
+        nubes_codigo = " ".join(nubes) or "NSC"
+
+    m = RE_TEMP.match(tokens[i]) if i < len(tokens) else None
+    if not m:
+        raise ValueError("Falta el grupo de temperatura T/Td")
+    temp, rocio = (_temperatura(t.replace("-", "M")) for t in m.groups())
+    i += 1
+    m = RE_QNH.match(tokens[i]) if i < len(tokens) else None
+    if not m:
+        raise ValueError("Falta el grupo de presión QNNNN")
+    qnh = float(m.group(1))
+    i += 1
+
+    fenomeno = " ".join(wx)
+    return RegistroMetar(
+        dia             = dia,
+        hora            = hora,
+        tipo            = tipo,
+        dir_viento      = direccion,
+        int_viento      = int_viento,
+        var_viento      = var_viento,
+        vis_original    = vis_original,
+        vis_metros      = vis_m,
+        vis_minima      = vis_min,
+        rvr             = " ".join(rvr),
+        fenomeno_texto  = fenomeno,
+        fenomeno_codigo = fenomeno,
+        nubes           = tuple(capas),
+        nubes_codigo    = nubes_codigo,
+        temperatura     = temp,
+        rocio           = rocio,
+        qnh             = qnh,
+        suplementaria   = " ".join(tokens[i:]),
+        metar           = " ".join(tokens) + "=",
+    )
+
+
+def a_formulario(registro):
+    """Datos con la forma de /generar que vuelven a dar el mismo boletín."""
+    return {
+        "tipo":          registro.tipo,
+        "dia":           registro.dia,
+        "hora":          registro.hora,
+        "dir_viento":    str(registro.dir_viento),
+        "int_viento":    str(registro.int_viento),
+        "var_viento":    registro.var_viento,
+        "vis":           str(registro.vis_original or registro.vis_metros),
+        "vis_min":       registro.vis_minima,
+        "rvr":           registro.rvr,
+        "fenomenos":     registro.fenomeno_codigo.split(),
+        "nubes":         [c._asdict() for c in registro.nubes],
+        "temp":          str(registro.temperatura),
+        "rocio":         str(registro.rocio),
+        "hr":            "",
+        "qnh":           str(registro.qnh),
+        "presion":       "",
+        "suplementaria": registro.suplementaria,
+    }
+
+
+def decodificar_linea(linea, mes=None, estacion=None):
+    """(mes, RegistroMetar) de una línea del archivo, con o sin fecha previa."""
+    m = RE_FECHA.match(linea)
+    if m:
+        mes = f"{m.group(1)}_{m.group(2)}"
+        linea = linea[m.end():]
+    if not mes:
+        raise ValueError("Línea sin fecha AAAAMMDDHHMM y sin --mes")
+    return mes, decodificar_metar(linea, estacion)
+
+
+def leer_boletines(lineas, mes=None, primera=1, estacion=None):
+    """Genera (número de línea, mes, registro o ValueError); omite vacías."""
+    for n, linea in enumerate(lineas, start=primera):
+        linea = linea.strip()
+        if not linea or linea.startswith("#"):
+            continue
+        try:
+            m, registro = decodificar_linea(linea, mes, estacion)
+            yield n, m, registro
+        except (ValueError, IndexError) as e:
+            yield n, mes, ValueError(str(e) or "Boletín incompleto")
+
+
+def _decodificar_bloque(args):
+    lineas, mes, primera, estacion = args
+    return list(leer_boletines(lineas, mes, primera, estacion))
+
+
+def decodificar_archivo(ruta, mes=None, procesos=None, bloque=5000, estacion=None):
+    """Como leer_boletines() pero sobre un archivo, en varios procesos.
+
+    Solo hay `2 * procesos` bloques en vuelo a la vez, así que la memoria
+    no crece con el archivo; los resultados salen en el orden del archivo.
+    """
+    procesos = procesos or os.cpu_count() or 1
+    with open(ruta, encoding="utf-8", errors="replace") as f:
+        if procesos == 1:
+            yield from leer_boletines(f, mes, estacion=estacion)
+            return
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            en_vuelo, primera = [], 1
+            while True:
+                lineas = list(islice(f, bloque))
+                if lineas:
+                    en_vuelo.append(pool.submit(_decodificar_bloque, (lineas, mes, primera, estacion)))
+                    primera += len(lineas)
+                if en_vuelo and (len(en_vuelo) >= 2 * procesos or not lineas):
+                    yield from en_vuelo.pop(0).result()
+                elif not lineas:
+                    return
+
+
+def importar_archivo(ruta, guardar, mes=None, procesos=None, lote=5000, estacion=None):
+    """Decodifica `ruta` y entrega los registros a guardar(mes, registros)
+    en lotes de hasta `lote` por mes. Devuelve un resumen con los errores."""
+    inicio = time.perf_counter()
+    lineas = registros = 0
+    errores, pendientes = [], {}
+    for n, m, registro in decodificar_archivo(ruta, mes, procesos, estacion=estacion):
+        lineas += 1
+        if isinstance(registro, ValueError):
+            errores.append((n, str(registro)))
+            continue
+        registros += 1
+        pendientes.setdefault(m, []).append(registro)
+        if len(pendientes[m]) >= lote:
+            guardar(m, pendientes.pop(m))
+    for m, lista in pendientes.items():
+        guardar(m, lista)
+    duracion = time.perf_counter() - inicio
+    return {
+        "lineas": lineas,
+        "registros": registros,
+        "errores": errores,
+        "segundos": duracion,
+        "lineas_por_segundo": lineas / duracion if duracion else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa boletines METAR/SPECI históricos")
+    parser.add_argument("archivo")
+    parser.add_argument("--mes", help="AAAA_MM para líneas sin fecha")
+    parser.add_argument("--estacion", default="SPJC", help="indicador OACI (por defecto SPJC)")
+    parser.add_argument("--procesos", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from app import aerodromo
+    try:
+        aero = aerodromo(args.estacion.upper())
+    except KeyError as e:
+        parser.error(e.args[0])
+    almacen, escritor = aero.almacen, aero.escritor
+
+    meses = set()
+    def guardar(mes, lote):
+        almacen.actualizar_o_insertar_lote(mes, lote)
+        meses.add(mes)
+
+    resumen = importar_archivo(args.archivo, guardar, args.mes, args.procesos,
+                               estacion=aero.codigo)
+    for mes in sorted(meses):
+        escritor.vaciar(mes)
+    for n, error in resumen["errores"][:20]:
+        print(f"línea {n}: {error}")
+    print(f"{resumen['registros']} registros de {resumen['lineas']} líneas "
+          f"({len(resumen['errores'])} con error) en {resumen['segundos']:.1f} s "
+          f"— {resumen['lineas_por_segundo']:,.0f} líneas/s; meses: {', '.join(sorted(meses))}")
+
+
+if __name__ == "__main__":
+    main()
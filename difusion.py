@@ -0,0 +1,127 @@
+"""
+Difusión en vivo de los boletines emitidos (Server-Sent Events).
+
+Cada boletín generado o actualizado se publica una vez en el Difusor, que
+lo guarda en un búfer circular y lo copia a la cola acotada de cada
+suscriptor. Publicar nunca espera: si la cola de un cliente lento se
+llena, ese cliente se pone al día desde el búfer circular en su próxima
+lectura (o recibe "reinicio" si ya no alcanza). Los clientes que se
+reconectan con Last-Event-ID reciben lo que se perdieron del mismo búfer.
+"""
+
+from collections import deque
+from typing import NamedTuple
+import json
+import queue
+import threading
+import time
+
+TAMANO_BUFER = 500      # eventos que se pueden repetir al reconectar
+TAMANO_COLA  = 64       # eventos pendientes por suscriptor
+ESPERA_PING  = 15.0     # segundos sin eventos antes de enviar un comentario
+
+
+class Evento(NamedTuple):
+    id: int
+    tipo: str
+    datos: dict
+
+    def sse(self):
+        return f"id: {self.id}\nevent: {self.tipo}\ndata: {json.dumps(self.datos, ensure_ascii=False)}\n\n"
+
+
+class Suscripcion:
+    __slots__ = ("cola", "ultimo_id", "desbordada")
+
+    def __init__(self, ultimo_id):
+        self.cola = queue.Queue(maxsize=TAMANO_COLA)
+        self.ultimo_id = ultimo_id
+        self.desbordada = False
+
+
+class Difusor:
+    """Publicación/suscripción en el proceso, con búfer para reanudar."""
+
+    def __init__(self, tamano_bufer=TAMANO_BUFER):
+        self._bufer = deque(maxlen=tamano_bufer)
+        self._suscripciones = set()
+        self._lock = threading.Lock()
+        # Ids crecientes también entre reinicios del proceso: un Last-Event-ID
+        # de una ejecución anterior queda fuera del búfer y provoca "reinicio"
+        self._ultimo_id = time.time_ns() // 1_000_000
+
+    def publicar(self, tipo, datos):
+        with self._lock:
+            self._ultimo_id += 1
+            evento = Evento(self._ultimo_id, tipo, datos)
+            self._bufer.append(evento)
+            for s in self._suscripciones:
+                try:
+                    s.cola.put_nowait(evento)
+                except queue.Full:
+                    s.desbordada = True
+        return evento.id
+
+    def _desde(self, ultimo_id):
+        """Eventos posteriores a `ultimo_id`, o None si el búfer ya no los tiene."""
+        with self._lock:
+            if ultimo_id > self._ultimo_id:
+                return None
+            primero = self._bufer[0].id if self._bufer else self._ultimo_id + 1
+            if ultimo_id < primero - 1:        # p. ej. de antes de reiniciar, con el búfer vacío
+                return None
+            return [e for e in self._bufer if e.id > ultimo_id]
+
+    def suscriptores(self):
+        return len(self._suscripciones)
+
+    def suscribir(self, ultimo_id=None):
+        """Registra un suscriptor desde ya; con `ultimo_id` se le repiten
+        los eventos posteriores a ese id."""
+        with self._lock:
+            s = Suscripcion(self._ultimo_id if ultimo_id is None else ultimo_id)
+            s.desbordada = ultimo_id is not None   # la primera lectura repite desde el búfer
+            self._suscripciones.add(s)
+        return s
+
+    def cancelar(self, s):
+        with self._lock:
+            self._suscripciones.discard(s)
+
+    def escuchar(self, s, espera=ESPERA_PING):
+        """Genera los eventos de la suscripción `s`; None cada `espera` s
+        sin novedades. Al terminar cancela la suscripción."""
+        try:
+            while True:
+                if s.desbordada:
+                    s.desbordada = False
+                    # Primero lo que quedó en la cola, luego lo perdido desde el búfer
+                    en_cola = []
+                    while True:
+                        try:
+                            en_cola.append(s.cola.get_nowait())
+                        except queue.Empty:
+                            break
+                    for evento in en_cola:
+                        if evento.id > s.ultimo_id:
+                            s.ultimo_id = evento.id
+                            yield evento
+                    pendientes = self._desde(s.ultimo_id)
+                    if pendientes is None:
+                        with self._lock:
+                            s.ultimo_id = self._ultimo_id
+                        yield Evento(s.ultimo_id, "reinicio", {})
+                        pendientes = []
+                    for evento in pendientes:
+                        s.ultimo_id = evento.id
+                        yield evento
+                try:
+                    evento = s.cola.get(timeout=espera)
+                except queue.Empty:
+                    yield None
+                    continue
+                if evento.id > s.ultimo_id:      # ya enviado al ponerse al día
+                    s.ultimo_id = evento.id
+                    yield evento
+        finally:
+            self.cancelar(s)
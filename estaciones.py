@@ -0,0 +1,52 @@
+"""
+Estaciones (aeródromos) que atiende el sistema y sus reglas propias.
+
+Se leen una sola vez, la primera vez que se consultan, de estaciones.json
+(o del archivo indicado en METAR_ESTACIONES):
+
+    {"SPQU": {"nombre": "Arequipa", "hora_tn": "1200", "hora_tx": "2200"}}
+
+`hora_tn` / `hora_tx` son los boletines que deben llevar la temperatura
+mínima (TNxxx) y máxima (TXxxx); null si la estación no las informa. SPJC
+está siempre, aunque no figure en el archivo.
+"""
+
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple
+import json
+import os
+import re
+
+ESTACION = "SPJC"          # estación por defecto
+ARCHIVO  = Path(__file__).resolve().with_name("estaciones.json")
+RE_OACI  = re.compile(r"^[A-Z]{4}$")
+
+
+class ReglasEstacion(NamedTuple):
+    codigo: str
+    nombre: str = ""
+    hora_tn: str = "1200"
+    hora_tx: str = "2200"
+
+
+@lru_cache(maxsize=1)
+def estaciones():
+    """{código OACI: ReglasEstacion} de las estaciones configuradas."""
+    ruta = Path(os.environ.get("METAR_ESTACIONES") or ARCHIVO)
+    datos = json.loads(ruta.read_text(encoding="utf-8")) if ruta.exists() else {}
+    salida = {ESTACION: ReglasEstacion(ESTACION, "Aeropuerto Internacional Jorge Chávez")}
+    for codigo, conf in datos.items():
+        # El código se usa en nombres de archivo: solo cuatro letras
+        if not RE_OACI.match(codigo):
+            raise ValueError(f"Indicador OACI inválido en {ruta}: {codigo!r}")
+        salida[codigo] = ReglasEstacion(codigo, **conf)
+    return salida
+
+
+def reglas(codigo=ESTACION):
+    """Reglas de la estación; KeyError si no está configurada."""
+    try:
+        return estaciones()[codigo]
+    except KeyError:
+        raise KeyError(f"Estación desconocida: {codigo}") from None
@@ -0,0 +1,166 @@
+"""
+Estadísticas climatológicas mensuales a partir de los registros del mes.
+
+Todo se calcula con NumPy sobre las columnas de archivo_columnar. Los
+resultados se guardan por día: cuando el almacén avisa que cambió un
+registro, solo se recalcula ese día y se vuelve a sumar el mes.
+"""
+
+import threading
+
+import numpy as np
+
+from archivo_columnar import a_columnas
+
+SECTORES = ["N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE",
+            "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW"]
+INTENSIDADES = ["1-5", "6-10", "11-20", ">20"]
+LIMITES_INTENSIDAD = [6, 11, 21]                    # kt
+UMBRALES_VISIBILIDAD = [5000, 3000, 1500, 800]      # m
+TECHOS = ["<500", "500-999", "1000-1499", "1500-2999", ">=3000"]
+LIMITES_TECHO = [500, 1000, 1500, 3000]             # ft
+HORAS_POR_METAR = 0.5                               # un METAR cada 30 min
+CAUSAS_SPECI = ["visibilidad", "techo", "tormenta", "viento", "precipitación"]
+
+
+def _tiene(columna, *textos):
+    encontrado = np.zeros(len(columna), dtype=bool)
+    for t in textos:
+        encontrado |= np.char.find(columna, t) >= 0
+    return encontrado
+
+
+def _min_media_max(valores):
+    valores = valores[~np.isnan(valores)]
+    if not len(valores):
+        return None
+    return {"min": round(float(valores.min()), 1),
+            "media": round(float(valores.mean()), 1),
+            "max": round(float(valores.max()), 1)}
+
+
+def resumen_dia(d):
+    """Agregados de un día (arreglo con las columnas de archivo_columnar)."""
+    metar = d["tipo"] == b"METAR"
+    speci = ~metar
+
+    # Rosa de vientos: sector de 22.5° × intensidad; calmas y VRB aparte
+    calma = d["viento"] == 0
+    variable = (d["dir"] < 0) & ~calma
+    con_dir = ~calma & ~variable
+    sector = ((d["dir"][con_dir] + 11.25) // 22.5).astype(int) % 16
+    banda = np.digitize(d["viento"][con_dir], LIMITES_INTENSIDAD)
+    rosa = np.bincount(sector * len(INTENSIDADES) + banda,
+                       minlength=16 * len(INTENSIDADES)).reshape(16, len(INTENSIDADES))
+
+    horas_vis = np.array([np.count_nonzero(metar & (d["vis"] < u))
+                          for u in UMBRALES_VISIBILIDAD]) * HORAS_POR_METAR
+
+    con_techo = metar & (d["techo"] >= 0)
+    techos = np.bincount(np.digitize(d["techo"][con_techo], LIMITES_TECHO),
+                         minlength=len(TECHOS))
+
+    causas = np.array([
+        np.count_nonzero(speci & ((d["vis"] < 5000) | (d["vis_min"] >= 0))),
+        np.count_nonzero(speci & (d["techo"] >= 0) & (d["techo"] < 1500)),
+        np.count_nonzero(speci & (_tiene(d["wx"], b"TS") | _tiene(d["nubes"], b"CB", b"TCU"))),
+        np.count_nonzero(speci & (d["racha"] >= 0)),
+        np.count_nonzero(speci & _tiene(d["wx"], b"RA", b"DZ", b"SN", b"GR")),
+    ])
+
+    return {
+        "metar": int(np.count_nonzero(metar)),
+        "speci": int(np.count_nonzero(speci)),
+        "rosa": rosa,
+        "calmas": int(np.count_nonzero(calma)),
+        "variables": int(np.count_nonzero(variable)),
+        "horas_vis": horas_vis,
+        "techos": techos,
+        "sin_techo": int(np.count_nonzero(metar & (d["techo"] < 0))),
+        "causas": causas,
+        "temp": _min_media_max(d["temp"].astype(float)),
+        "rocio": _min_media_max(d["rocio"].astype(float)),
+        "qnh": _min_media_max(d["qnh"].astype(float)),
+    }
+
+
+def resumenes_por_dia(mes, registros):
+    """{día: resumen_dia} para los registros dados."""
+    d = a_columnas(mes, registros)
+    dias = (d["fecha"] - d["fecha"].astype("datetime64[M]")).astype("timedelta64[D]").astype(int) + 1
+    return {f"{dia:02d}": resumen_dia(d[dias == dia]) for dia in np.unique(dias)}
+
+
+def combinar(estacion, mes, por_dia):
+    """Resumen del mes a partir de los resúmenes diarios."""
+    dias = [por_dia[k] for k in sorted(por_dia)]
+
+    def suma(campo, forma):
+        return sum((x[campo] for x in dias), np.zeros(forma, dtype=float))
+
+    rosa      = suma("rosa", (16, len(INTENSIDADES)))
+    horas_vis = suma("horas_vis", len(UMBRALES_VISIBILIDAD))
+    techos    = dict(zip(TECHOS, suma("techos", len(TECHOS)).astype(int).tolist()))
+    techos["sin techo"] = sum(x["sin_techo"] for x in dias)
+    causas    = suma("causas", len(CAUSAS_SPECI))
+    return {
+        "estacion": estacion,
+        "mes": mes,
+        "metar": sum(x["metar"] for x in dias),
+        "speci": sum(x["speci"] for x in dias),
+        "rosa_vientos": {
+            "sectores": SECTORES,
+            "intensidades": INTENSIDADES,
+            "conteos": rosa.astype(int).tolist(),
+            "calmas": sum(x["calmas"] for x in dias),
+            "variables": sum(x["variables"] for x in dias),
+        },
+        "horas_visibilidad": {f"<{u}": float(h) for u, h in zip(UMBRALES_VISIBILIDAD, horas_vis)},
+        "frecuencia_techo": techos,
+        "speci_por_causa": dict(zip(CAUSAS_SPECI, causas.astype(int).tolist())),
+        "diario": [{"dia": k, "temp": por_dia[k]["temp"], "rocio": por_dia[k]["rocio"],
+                    "qnh": por_dia[k]["qnh"]} for k in sorted(por_dia)],
+    }
+
+
+class CacheEstadisticas:
+    """Estadísticas por (estación, mes) que se invalidan por día.
+
+    `invalidar()` se llama cuando el almacén cambia registros, con sus
+    claves (día, hora); si los avisos llegan en cadena (la versión anterior coincide), en la próxima
+    consulta solo se recalculan los días afectados.
+    """
+
+    def __init__(self):
+        self._meses = {}
+        self._lock = threading.Lock()
+
+    def invalidar(self, estacion, mes, claves, version_anterior, version_nueva):
+        with self._lock:
+            e = self._meses.get((estacion, mes))
+            if e is None:
+                return
+            if claves is None or e["esperada"] != version_anterior:
+                del self._meses[(estacion, mes)]
+                return
+            e["sucios"] |= {dia for dia, _ in claves}
+            e["esperada"] = version_nueva
+
+    def obtener(self, estacion, mes, version, registros):
+        """Estadísticas del mes para `registros` (RegistrosMes) en `version`."""
+        with self._lock:
+            e = self._meses.get((estacion, mes))
+            if e and e["version"] == version:
+                return e["resultado"]
+            if e and e["esperada"] == version:
+                por_dia = dict(e["por_dia"])
+                for dia in e["sucios"]:
+                    por_dia.pop(dia, None)
+                    del_dia = registros.rango((dia, "0000"), (dia, "9999"))
+                    por_dia.update(resumenes_por_dia(mes, del_dia))
+            else:
+                por_dia = resumenes_por_dia(mes, registros)
+            e = {"version": version, "esperada": version, "sucios": set(),
+                 "por_dia": por_dia, "resultado": combinar(estacion, mes, por_dia)}
+            self._meses[(estacion, mes)] = e
+            return e["resultado"]
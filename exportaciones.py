@@ -0,0 +1,206 @@
+"""
+Exportaciones de varios meses (reportes anuales a la DGAC) en segundo plano.
+
+Cada trabajo arma un libro con una hoja por mes y se ejecuta en un pool de
+procesos, fuera del hilo de la petición. El id del trabajo sale de la
+estación, el rango y la versión de cada mes de origen, así que:
+
+- pedir dos veces el mismo reporte sin cambios devuelve el archivo ya hecho;
+- si cambia cualquier mes del rango, el id cambia y se arma uno nuevo.
+
+El estado vive en archivos junto al reporte (<id>.progreso, <id>.error,
+<id>.xlsx), de modo que cualquier worker puede responder la consulta.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from registro import COLUMNAS_EXCEL, RegistroMetar
+
+# Un archivo .progreso sin cambios por más que esto es de un trabajo que murió
+ABANDONADO = 15 * 60
+RE_ID = re.compile(r"^[A-Z]{4}_\d{4}_\d{2}_\d{4}_\d{2}_[0-9a-f]{12}$")
+
+
+def _escribir_json(ruta, datos):
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    Path(temporal).write_text(json.dumps(datos, ensure_ascii=False), encoding="utf-8")
+    os.replace(temporal, ruta)
+
+
+def _registros_almacen(ruta_db, estacion, mes):
+    con = sqlite3.connect(f"file:{ruta_db}?mode=ro", uri=True, timeout=30)
+    try:
+        for (datos,) in con.execute(
+                "SELECT datos FROM observaciones WHERE estacion=? AND mes=? "
+                "ORDER BY dia, hora", (estacion, mes)):
+            yield RegistroMetar.desde_json(datos)
+    finally:
+        con.close()
+
+
+def _registros_excel(archivo):
+    import pandas as pd
+    df = pd.read_excel(archivo, sheet_name=0).reindex(columns=list(COLUMNAS_EXCEL))
+    df = df.astype(object).where(df.notna(), "")
+    df["DIA"]  = df["DIA"].astype(str).str.zfill(2)
+    df["HORA"] = df["HORA"].astype(str).str.zfill(4)
+    return (RegistroMetar.desde_fila_excel(fila) for fila in df.itertuples(index=False, name=None))
+
+
+def construir_reporte(destino, ruta_db, estacion, fuentes):
+    """Se ejecuta en el pool. `fuentes` son (mes, "almacen" | ruta del Excel)."""
+    from control_calidad import COLUMNA, auditar, texto
+    from exportador_excel import escribir_hojas
+
+    destino = Path(destino)
+    progreso = destino.with_suffix(".progreso")
+
+    def avance(hechos):
+        _escribir_json(progreso, {"hechos": hechos, "total": len(fuentes)})
+
+    def hojas():
+        # De a un mes en memoria: hace falta el mes completo para auditarlo
+        for mes, origen in fuentes:
+            registros = list(_registros_almacen(ruta_db, estacion, mes) if origen == "almacen"
+                             else _registros_excel(origen))
+            banderas = auditar(mes, registros)
+            yield mes, (r.a_fila_excel() + [texto(banderas.get(r.clave))] for r in registros)
+
+    try:
+        escribir_hojas(hojas(), destino, COLUMNAS_EXCEL + (COLUMNA,), progreso=avance)
+        # Reportes anteriores del mismo rango quedan obsoletos
+        prefijo = destino.stem.rsplit("_", 1)[0]
+        for viejo in destino.parent.glob(f"{prefijo}_*.xlsx"):
+            if viejo != destino:
+                viejo.unlink(missing_ok=True)
+    except Exception as e:
+        _escribir_json(destino.with_suffix(".error"), {"error": str(e)})
+        raise
+    finally:
+        progreso.unlink(missing_ok=True)
+
+
+class PoolExportaciones:
+    """Pool de procesos compartido por las colas de todas las estaciones.
+
+    Hay uno por proceso (por worker del servidor): como mucho `maximo`
+    trabajos a la vez en ese worker, sumando todas las estaciones, así que
+    el total del servidor es `maximo` × workers.
+    """
+
+    def __init__(self, maximo=2):
+        self.maximo   = maximo
+        self._pool    = None
+        self._futuros = set()
+        self._lock    = threading.Lock()
+
+    def enviar(self, antes, *argumentos):
+        """Future del trabajo, o None si ya hay `maximo` en curso. `antes()`
+        se llama justo antes de encolarlo, solo si hay lugar."""
+        with self._lock:
+            self._futuros = {f for f in self._futuros if not f.done()}
+            if len(self._futuros) >= self.maximo:
+                return None
+            antes()
+            try:
+                futuro = self._nuevo_pool(False).submit(*argumentos)
+            except BrokenProcessPool:      # un hijo murió antes: se arma otro pool
+                futuro = self._nuevo_pool(True).submit(*argumentos)
+            self._futuros.add(futuro)
+            return futuro
+
+    def _nuevo_pool(self, reemplazar):
+        if self._pool is None or reemplazar:
+            # spawn: el proceso hijo no hereda hilos ni conexiones del servidor
+            self._pool = ProcessPoolExecutor(self.maximo,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def detener(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ColaExportaciones:
+    """Recibe pedidos de reportes de una estación y los manda a `pool`
+    (PoolExportaciones, compartido con las demás estaciones del worker).
+
+    `enviar()` devuelve None si el pool ya está lleno.
+    """
+
+    def __init__(self, directorio, ruta_db, pool):
+        self.directorio = Path(directorio)
+        self.ruta_db    = str(ruta_db)
+        self.pool       = pool
+        self._trabajos  = {}          # id -> Future
+        self._lock      = threading.Lock()
+
+    def _ruta(self, id_trabajo, extension):
+        return self.directorio / f"{id_trabajo}.{extension}"
+
+    @staticmethod
+    def id_trabajo(estacion, desde, hasta, fuentes):
+        """`fuentes`: (mes, origen, versión) de cada mes del rango."""
+        huella = hashlib.sha256(repr(sorted(fuentes)).encode()).hexdigest()[:12]
+        return f"{estacion}_{desde}_{hasta}_{huella}"
+
+    def enviar(self, id_trabajo, estacion, fuentes):
+        """Encola el trabajo si no está hecho ni en curso; devuelve su estado,
+        o None si se alcanzó el máximo de trabajos simultáneos."""
+        with self._lock:
+            estado = self.estado(id_trabajo)
+            if estado["estado"] in ("listo", "en_curso"):
+                return estado
+
+            def preparar():
+                self.directorio.mkdir(parents=True, exist_ok=True)
+                self._ruta(id_trabajo, "error").unlink(missing_ok=True)
+                _escribir_json(self._ruta(id_trabajo, "progreso"),
+                               {"hechos": 0, "total": len(fuentes)})
+
+            futuro = self.pool.enviar(
+                preparar, construir_reporte, str(self._ruta(id_trabajo, "xlsx")), self.ruta_db,
+                estacion, [(mes, origen) for mes, origen, _ in fuentes])
+            if futuro is None:
+                return None
+            self._trabajos[id_trabajo] = futuro
+            return self.estado(id_trabajo)
+
+    def estado(self, id_trabajo):
+        salida = {"id": id_trabajo, "estado": "desconocido"}
+        archivo, error, progreso = (self._ruta(id_trabajo, e) for e in ("xlsx", "error", "progreso"))
+        futuro = self._trabajos.get(id_trabajo)
+        if archivo.exists():
+            salida.update(estado="listo", bytes=archivo.stat().st_size)
+        elif futuro is not None and futuro.cancelled() and not error.exists():
+            salida.update(estado="error", error="La exportación se canceló")
+        elif futuro is not None and futuro.done() and futuro.exception() and not error.exists():
+            # p. ej. el proceso del pool murió sin llegar a escribir el .error
+            salida.update(estado="error", error=str(futuro.exception()) or "Falló la exportación")
+        elif error.exists():
+            salida.update(estado="error", **json.loads(error.read_text(encoding="utf-8")))
+        elif progreso.exists():
+            try:
+                avance = json.loads(progreso.read_text(encoding="utf-8"))
+                edad = time.time() - progreso.stat().st_mtime
+            except (OSError, ValueError):     # se está reemplazando justo ahora
+                avance, edad = {}, 0
+            if edad > ABANDONADO and futuro is None:
+                salida.update(estado="error", error="El trabajo se interrumpió")
+            else:
+                salida.update(estado="en_curso", **avance)
+        return salida
+
+    def archivo(self, id_trabajo):
+        ruta = self._ruta(id_trabajo, "xlsx")
+        return ruta if ruta.exists() else None
@@ -0,0 +1,110 @@
+"""
+Escritura de los Excel mensuales en modo streaming (openpyxl write_only).
+
+Los estilos se crean una sola vez como estilos con nombre del libro y cada
+celda solo guarda una referencia a ellos. Las filas se escriben a medida
+que llegan, así que la memoria no crece con el número de registros.
+"""
+
+from copy import copy
+from itertools import chain, islice
+import os
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+# Filas (encabezado incluido) que se miden para el ancho de cada columna
+FILAS_ANCHO = 101
+ANCHO_MAXIMO = 80
+ALTO_ENCABEZADO = 30
+
+
+def _estilos():
+    gris  = Side(style="thin", color="CCCCCC")
+    borde = Border(left=gris, right=gris, top=gris, bottom=gris)
+    fino  = Side(style="thin")          # el borde que ponía pandas al encabezado
+    centro = Alignment(horizontal="center", vertical="center")
+
+    encabezado = NamedStyle(name="metar_encabezado")
+    encabezado.font      = Font(name="Calibri", size=11, bold=True, color="FFFFFF")
+    encabezado.fill      = PatternFill(start_color="0B3D91", end_color="0B3D91", fill_type="solid")
+    encabezado.alignment = centro
+    encabezado.border    = Border(left=fino, right=fino, top=fino, bottom=fino)
+
+    fila = NamedStyle(name="metar_fila")
+    fila.font      = Font(name="Calibri", size=10)
+    fila.alignment = centro
+    fila.border    = borde
+
+    speci = NamedStyle(name="metar_speci")
+    speci.font      = Font(name="Calibri", size=10, bold=True)
+    speci.fill      = PatternFill(start_color="FFE699", end_color="FFE699", fill_type="solid")
+    speci.alignment = centro
+    speci.border    = borde
+    return encabezado, fila, speci
+
+
+def escribir_libro(filas, destino, columnas, hoja, col_tipo=2):
+    """Escribe `filas` (tuplas en el orden de `columnas`) en `destino`.
+
+    `col_tipo` es el índice de la columna TIPO: las filas SPECI van en
+    negrita sobre fondo amarillo.
+    """
+    escribir_hojas([(hoja, filas)], destino, columnas, col_tipo)
+
+
+def escribir_hojas(hojas, destino, columnas, col_tipo=2, progreso=None):
+    """Como escribir_libro() pero con varias hojas: `hojas` son pares
+    (nombre, filas). Si se da, `progreso(i)` se llama al terminar la hoja i."""
+    wb = Workbook(write_only=True)
+    encabezado, normal, speci = _estilos()
+    for estilo in (encabezado, normal, speci):
+        wb.add_named_style(estilo)
+
+    for n, (hoja, filas) in enumerate(hojas, start=1):
+        filas = iter(filas)
+        muestra = list(islice(filas, FILAS_ANCHO - 1))
+
+        # Anchos en una sola pasada por la muestra (encabezado incluido)
+        anchos = [len(str(c)) for c in columnas]
+        for fila in muestra:
+            for i, valor in enumerate(fila):
+                largo = len(str(valor or ""))
+                if largo > anchos[i]:
+                    anchos[i] = largo
+
+        ws = wb.create_sheet(hoja)
+        for i, ancho in enumerate(anchos, start=1):
+            ws.column_dimensions[get_column_letter(i)].width = min(ancho + 3, ANCHO_MAXIMO)
+        ws.row_dimensions[1].height = ALTO_ENCABEZADO
+        ws.freeze_panes = "A2"
+
+        # Una celda modelo por estilo; las demás copian su índice de estilo
+        modelos = {}
+        for estilo in (encabezado, normal, speci):
+            modelos[estilo.name] = WriteOnlyCell(ws)
+            modelos[estilo.name].style = estilo.name
+
+        def celdas(valores, estilo):
+            modelo = modelos[estilo]._style
+            salida = []
+            for valor in valores:
+                c = WriteOnlyCell(ws, value=None if valor == "" else valor)
+                c._style = copy(modelo)
+                salida.append(c)
+            return salida
+
+        ws.append(celdas(columnas, encabezado.name))
+        for fila in chain(muestra, filas):
+            ws.append(celdas(fila, speci.name if fila[col_tipo] == "SPECI" else normal.name))
+        if progreso:
+            progreso(n)
+
+    if isinstance(destino, (str, os.PathLike)):
+        temporal = f"{destino}.{os.getpid()}.tmp"    # nombre propio de cada proceso
+        wb.save(temporal)
+        os.replace(temporal, destino)
+    else:
+        wb.save(destino)
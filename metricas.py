@@ -0,0 +1,128 @@
+"""
+Métricas del proceso en formato de texto de Prometheus.
+
+Contadores, histogramas e indicadores mínimos, sin dependencias. Las
+etapas se miden con
+
+    with etapa("validacion"):
+        ...
+
+que suma la duración al histograma metar_etapa_segundos y, dentro de una
+petición, la anota en el desglose que se escribe en el registro de
+peticiones lentas. Con varios workers cada proceso tiene sus propias
+métricas (Prometheus las distingue por instancia).
+"""
+
+from contextlib import contextmanager
+import threading
+import time
+
+from flask import g, has_request_context
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registradas = []
+
+
+def _etiquetas(clave):
+    if not clave:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in clave) + "}"
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre, ayuda):
+        self.nombre = nombre
+        self.ayuda  = ayuda
+        self._valores = {}
+        self._lock = threading.Lock()
+        _registradas.append(self)
+
+    def _lineas(self):
+        raise NotImplementedError
+
+    def exponer(self):
+        with self._lock:
+            lineas = self._lineas()
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"] + lineas
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def incrementar(self, n=1, **etiquetas):
+        clave = tuple(sorted(etiquetas.items()))
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + n
+
+    def _lineas(self):
+        return [f"{self.nombre}{_etiquetas(k)} {v}" for k, v in sorted(self._valores.items())]
+
+
+class Indicador(_Metrica):
+    tipo = "gauge"
+
+    def fijar(self, valor, **etiquetas):
+        with self._lock:
+            self._valores[tuple(sorted(etiquetas.items()))] = valor
+
+    def _lineas(self):
+        return [f"{self.nombre}{_etiquetas(k)} {v}" for k, v in sorted(self._valores.items())]
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, buckets=BUCKETS_SEGUNDOS):
+        super().__init__(nombre, ayuda)
+        self.buckets = tuple(buckets)
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(sorted(etiquetas.items()))
+        with self._lock:
+            serie = self._valores.get(clave)
+            if serie is None:
+                serie = self._valores[clave] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def _lineas(self):
+        lineas = []
+        for clave, (conteos, suma, n) in sorted(self._valores.items()):
+            for limite, c in zip(self.buckets, conteos):
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(clave + (('le', limite),))} {c}")
+            lineas.append(f"{self.nombre}_bucket{_etiquetas(clave + (('le', '+Inf'),))} {n}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(clave)} {suma}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(clave)} {n}")
+        return lineas
+
+
+def exponer():
+    """Todas las métricas en el formato de texto de Prometheus."""
+    lineas = []
+    for m in _registradas:
+        lineas.extend(m.exponer())
+    return "\n".join(lineas) + "\n"
+
+
+# ─────────────────────────────────────────────
+# ETAPAS
+# ─────────────────────────────────────────────
+duracion_etapa = Histograma("metar_etapa_segundos", "Duración de cada etapa del procesamiento")
+
+
+@contextmanager
+def etapa(nombre):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        duracion_etapa.observar(duracion, etapa=nombre)
+        if has_request_context():
+            g.setdefault("etapas", []).append((nombre, duracion))
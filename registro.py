@@ -0,0 +1,125 @@
+"""
+Registro compacto de una observación METAR/SPECI.
+
+Cada registro usa __slots__ en lugar de un dict con claves en español, y
+las capas de nubes se guardan como tuplas (octas, tipo, altura_m) en vez
+del texto repr() de una lista. Las conversiones con el esquema de
+columnas del Excel mensual y con el JSON del almacén están aquí.
+"""
+
+import ast
+import json
+from functools import lru_cache
+from typing import NamedTuple
+
+# Campos del registro, en el mismo orden que las columnas del Excel
+CAMPOS = (
+    "dia", "hora", "tipo",
+    "dir_viento", "int_viento", "var_viento",
+    "vis_original", "vis_metros", "vis_minima", "rvr",
+    "fenomeno_texto", "fenomeno_codigo",
+    "nubes", "nubes_codigo",
+    "temperatura", "rocio", "humedad", "qnh", "presion",
+    "suplementaria", "metar",
+)
+
+COLUMNAS_EXCEL = (
+    "DIA", "HORA", "TIPO",
+    "DIR VIENTO", "INTENSIDAD", "VARIACION",
+    "VIS (ORIGINAL)", "VIS (CODIGO)", "VIS MIN", "RVR",
+    "FENOMENO", "WX",
+    "NUBOSIDAD", "CLD",
+    "TEMP °C", "ROCÍO °C", "HR %", "QNH", "PRESION",
+    "RMK", "METAR",
+)
+
+_I_NUBES = CAMPOS.index("nubes")
+
+
+class CapaNube(NamedTuple):
+    octas: int
+    tipo: str
+    altura_m: int
+
+
+def capas_desde_formulario(nubes_lista):
+    """Capas tal como las guarda el formulario (lista de dicts)."""
+    return tuple(CapaNube(int(c.get("octas", 0)), str(c.get("tipo", "")),
+                          int(c.get("altura_m", 0)))
+                 for c in nubes_lista or ())
+
+
+def texto_nubes(capas):
+    """Texto de la columna NUBOSIDAD, igual al que escribían las versiones
+    anteriores (repr de la lista de dicts del formulario)."""
+    return str([{"octas": c.octas, "tipo": c.tipo, "altura_m": c.altura_m}
+                for c in capas])
+
+
+@lru_cache(maxsize=512)
+def capas_desde_texto(texto):
+    """Lee la columna NUBOSIDAD; texto vacío o ilegible da ()."""
+    if not texto or texto == "[]":
+        return ()
+    try:
+        return capas_desde_formulario(ast.literal_eval(texto))
+    except (ValueError, SyntaxError, TypeError, AttributeError):
+        return ()
+
+
+def _celda(valor):
+    # Celdas vacías de openpyxl/pandas (None, NaN) pasan a ""
+    if valor is None or valor != valor:
+        return ""
+    return valor.item() if hasattr(valor, "item") else valor
+
+
+class RegistroMetar:
+    """Una observación ya codificada. No se modifica después de creada."""
+
+    __slots__ = CAMPOS
+
+    def __init__(self, **valores):
+        for campo in CAMPOS:
+            setattr(self, campo, valores.pop(campo, ""))
+        if valores:
+            raise TypeError(f"Campos desconocidos: {', '.join(valores)}")
+        self.dia  = str(self.dia).zfill(2)
+        self.hora = str(self.hora).zfill(4)
+        self.nubes = tuple(CapaNube(*c) for c in self.nubes or ())
+
+    @property
+    def clave(self):
+        return self.dia, self.hora
+
+    def valores(self):
+        return tuple(getattr(self, campo) for campo in CAMPOS)
+
+    # ── Excel ──
+    def a_fila_excel(self):
+        fila = list(self.valores())
+        fila[_I_NUBES] = texto_nubes(self.nubes)
+        return fila
+
+    @classmethod
+    def desde_fila_excel(cls, fila):
+        """`fila` en el orden de COLUMNAS_EXCEL."""
+        valores = [_celda(v) for v in fila]
+        valores[_I_NUBES] = capas_desde_texto(str(valores[_I_NUBES]))
+        return cls(**dict(zip(CAMPOS, valores)))
+
+    # ── JSON (almacén) ──
+    def a_json(self):
+        return json.dumps(self.valores(), ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def desde_json(cls, texto):
+        return cls(**dict(zip(CAMPOS, json.loads(texto))))
+
+    def __eq__(self, otro):
+        if not isinstance(otro, RegistroMetar):
+            return NotImplemented
+        return self.valores() == otro.valores()
+
+    def __repr__(self):
+        return f"RegistroMetar({self.metar or self.dia + self.hora!r})"